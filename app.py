@@ -1,9 +1,17 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+import sqlite3
+import time
+import uuid
+from datetime import datetime, timedelta
 import plotly.express as px
 import plotly.graph_objects as go
 from supabase_backend import SupabaseManager
+from coda_scritture import CodaScritture
+from importazione import SCHEMI, importa_file
+from previsione_cassa import FREQUENZE, PrevisioneCassa
+from rollup import PERIODI, RollupFinanziario
+import documenti_preventivi
 
 # Configurazione pagina
 st.set_page_config(
@@ -19,11 +27,39 @@ def init_supabase():
 
 db = init_supabase()
 
+# Totali finanziari pre-aggregati, costruiti una volta e aggiornati a ogni inserimento
+@st.cache_resource
+def init_rollup():
+    return RollupFinanziario.da_dati(db.get_preventivi(), db.get_spese())
+
+rollup = init_rollup()
+
+# Le scritture dei form passano da un giornale locale e vengono inviate al database in background
+@st.cache_resource
+def init_coda():
+    # I totali dei report si aggiornano solo quando il database ha confermato la scrittura
+    return CodaScritture(db, al_salvataggio=rollup.aggiungi).avvia()
+
+coda = init_coda()
+
+# Letture dal database per tabella
+LETTORI = {
+    "clienti": db.get_clienti,
+    "preventivi": db.get_preventivi,
+    "spese": db.get_spese,
+    "scadenze": db.get_scadenze,
+    "eventi_calendario": db.get_eventi_calendario,
+}
+# Dopo quanti secondi rileggere comunque una tabella (modifiche fatte da altri utenti)
+SCADENZA_LETTURE = 60
+
 # Inizializza session state
-if 'clienti' not in st.session_state:
-    st.session_state.clienti = []
-if 'preventivi' not in st.session_state:
-    st.session_state.preventivi = []
+if 'versioni_dati' not in st.session_state:
+    st.session_state.versioni_dati = {tabella: 0 for tabella in LETTORI}
+if 'dati_letti' not in st.session_state:
+    st.session_state.dati_letti = {}
+if 'previsione_cassa' not in st.session_state:
+    st.session_state.previsione_cassa = PrevisioneCassa()
 
 # Header principale
 st.markdown("""
@@ -37,173 +73,753 @@ st.markdown("""
 st.sidebar.title("📋 Menu Principale")
 menu = st.sidebar.selectbox(
     "Scegli sezione:",
-    ["Dashboard", "Gestione Clienti", "Gestione Preventivi", "Analytics", "Reports & Export", "Amministrazione", "Demo"]
+    ["Dashboard", "Gestione Clienti", "Gestione Preventivi", "Analytics", "Reports & Export", "Amministrazione", "Importazione Dati", "Demo"]
 )
 
+conteggi_coda = coda.conteggi()
+if conteggi_coda.get("in_attesa") or conteggi_coda.get("in_invio"):
+    st.sidebar.caption(f"⏳ {conteggi_coda.get('in_attesa', 0) + conteggi_coda.get('in_invio', 0)} salvataggi in attesa di invio")
+if conteggi_coda.get("fallita"):
+    st.sidebar.warning(f"⚠️ {conteggi_coda['fallita']} salvataggi non riusciti")
+    with st.sidebar.expander("Dettagli salvataggi non riusciti"):
+        for scrittura in coda.fallite():
+            st.markdown(f"**{SCHEMI[scrittura['tabella']]['etichetta']}** — {scrittura['errore']}")
+            st.json(scrittura["record"], expanded=False)
+    col1, col2 = st.sidebar.columns(2)
+    if col1.button("🔁 Riprova invio"):
+        coda.riprova_fallite()
+        st.rerun()
+    if col2.button("🗑️ Scarta"):
+        coda.scarta_fallite()
+        st.rerun()
+
 # Funzioni helper
-def calcola_statistiche():
-    total_preventivi = len(st.session_state.preventivi)
-    total_clienti = len(st.session_state.clienti)
-    
-    if st.session_state.preventivi:
-        valore_accettato = sum(p['totale'] for p in st.session_state.preventivi if p['stato'] == 'ACCETTATO')
-        preventivi_inviati = len([p for p in st.session_state.preventivi if p['stato'] in ['INVIATO', 'ACCETTATO', 'RIFIUTATO']])
-        preventivi_accettati = len([p for p in st.session_state.preventivi if p['stato'] == 'ACCETTATO'])
+def leggi(tabella):
+    # Rilegge dal database solo se la tabella è stata modificata in questa sessione, se la coda
+    # ha confermato nuove scritture o se la copia è scaduta
+    versione = (st.session_state.versioni_dati[tabella], coda.generazione(tabella))
+    letti = st.session_state.dati_letti.get(tabella)
+    if letti is None or letti[0] != versione or time.time() - letti[1] > SCADENZA_LETTURE:
+        letti = (versione, time.time(), LETTORI[tabella]() or [])
+        st.session_state.dati_letti[tabella] = letti
+
+    # Le scritture ancora in coda compaiono subito, senza duplicare quelle già arrivate al database
+    in_attesa = coda.in_attesa(tabella)
+    if not in_attesa:
+        return letti[2]
+    chiave = SCHEMI[tabella]["chiave"]
+    if chiave:
+        presenti = {r.get(chiave) for r in letti[2]}
+        in_attesa = [r for r in in_attesa if r.get(chiave) not in presenti]
+    return letti[2] + in_attesa
+
+def salva(tabella, record):
+    # La chiave sopravvive a un accodamento fallito, così riprovare dopo un errore del giornale non duplica.
+    # Dopo un accodamento riuscito ne serve una nuova: un secondo invio del form è una seconda scrittura
+    chiave = st.session_state.setdefault(f"chiave_salvataggio_{tabella}", uuid.uuid4().hex)
+    try:
+        coda.accoda(tabella, record, chiave=chiave)
+    except sqlite3.Error:
+        return False
+    del st.session_state[f"chiave_salvataggio_{tabella}"]
+    return True
+
+def segna_modificata(*tabelle):
+    for tabella in tabelle or LETTORI:
+        st.session_state.versioni_dati[tabella] += 1
+
+def calcola_statistiche(preventivi, clienti):
+    total_preventivi = len(preventivi)
+    total_clienti = len(clienti)
+
+    if preventivi:
+        valore_accettato = sum(p['totale'] for p in preventivi if p['stato'] == 'ACCETTATO')
+        preventivi_inviati = len([p for p in preventivi if p['stato'] in ['INVIATO', 'ACCETTATO', 'RIFIUTATO']])
+        preventivi_accettati = len([p for p in preventivi if p['stato'] == 'ACCETTATO'])
         tasso_successo = (preventivi_accettati / preventivi_inviati * 100) if preventivi_inviati > 0 else 0
     else:
         valore_accettato = 0
         tasso_successo = 0
-    
+
     return total_preventivi, total_clienti, valore_accettato, tasso_successo
 
+# Sezioni della pagina.
+# Ogni form e ogni lista è un fragment: un'interazione al suo interno riesegue solo quel
+# blocco e rilegge solo le tabelle che usa. Dopo un inserimento riuscito la tabella viene
+# segnata come modificata e l'app viene rieseguita, così le liste collegate si aggiornano.
+@st.fragment
+def form_cliente():
+    st.subheader("Nuovo Cliente")
+
+    with st.form("form_cliente"):
+        nome = st.text_input("Nome/Ragione Sociale *")
+        email = st.text_input("Email")
+        telefono = st.text_input("Telefono")
+        note = st.text_area("Note Personali")
+
+        if st.form_submit_button("Aggiungi Cliente", type="primary"):
+            if nome:
+                nuovo_cliente = {
+                    "nome": nome,
+                    "email": email,
+                    "telefono": telefono,
+                    "note": note,
+                    "data_creazione": datetime.now().strftime("%d/%m/%Y")
+                }
+                if salva("clienti", nuovo_cliente):
+                    st.success(f"Cliente '{nome}' aggiunto con successo!")
+                    segna_modificata("clienti")
+                    st.rerun()
+                else:
+                    st.error("Errore nell'aggiungere il cliente")
+            else:
+                st.error("Il nome è obbligatorio!")
+
+@st.fragment
+def lista_clienti():
+    st.subheader("Lista Clienti")
+
+    clienti = leggi("clienti")
+
+    if clienti:
+        df_clienti = pd.DataFrame(clienti)
+        st.dataframe(df_clienti, use_container_width=True)
+    else:
+        st.info("Nessun cliente registrato. Aggiungi il primo cliente!")
+
+@st.fragment
+def form_preventivo():
+    st.subheader("Nuovo Preventivo")
+
+    clienti = leggi("clienti")
+
+    if not clienti:
+        st.warning("Prima devi aggiungere almeno un cliente!")
+    else:
+        with st.form("form_preventivo"):
+            numero = st.text_input("Numero Preventivo *")
+            cliente = st.selectbox("Cliente *", [c["nome"] for c in clienti])
+            note = st.text_area("Note per Cliente")
+            totale = st.number_input("Valore Totale €", min_value=0.0, step=0.01)
+
+            if st.form_submit_button("Crea Preventivo", type="primary"):
+                if numero and cliente:
+                    nuovo_preventivo = {
+                        "numero": numero,
+                        "cliente": cliente,
+                        "note": note,
+                        "stato": "BOZZA",
+                        "data_creazione": datetime.now().strftime("%d/%m/%Y"),
+                        "totale": totale
+                    }
+                    if salva("preventivi", nuovo_preventivo):
+                        st.success(f"Preventivo '{numero}' creato con successo!")
+                        segna_modificata("preventivi")
+                        st.rerun()
+                    else:
+                        st.error("Errore nel creare il preventivo")
+                else:
+                    st.error("Numero preventivo e cliente sono obbligatori!")
+
+@st.fragment
+def lista_preventivi():
+    st.subheader("Lista Preventivi")
+
+    preventivi = leggi("preventivi")
+
+    if preventivi:
+        df_preventivi = pd.DataFrame(preventivi)
+        st.dataframe(df_preventivi, use_container_width=True)
+
+        clienti_per_nome = {c["nome"]: c for c in leggi("clienti")}
+
+        # Documento PDF del singolo preventivo
+        st.subheader("📄 Documento Preventivo")
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            numero_doc = st.selectbox("Preventivo", [p["numero"] for p in preventivi])
+        preventivo_doc = next(p for p in preventivi if p["numero"] == numero_doc)
+        with col2:
+            # Il PDF viene generato solo su richiesta, non a ogni rerun della lista
+            if st.button("Genera PDF"):
+                st.download_button("Scarica PDF",
+                                   documenti_preventivi.genera_pdf(preventivo_doc,
+                                                                   clienti_per_nome.get(preventivo_doc["cliente"])),
+                                   file_name=documenti_preventivi.nome_file(preventivo_doc), mime="application/pdf",
+                                   type="primary")
+
+        # Generazione in blocco di tutti i documenti in un archivio ZIP
+        st.subheader("📦 Generazione in Blocco")
+        stati_doc = st.multiselect("Stati da includere", ["BOZZA", "INVIATO", "ACCETTATO", "RIFIUTATO"],
+                                   default=["BOZZA", "INVIATO", "ACCETTATO"])
+        selezionati = [p for p in preventivi if p["stato"] in stati_doc]
+
+        if st.button(f"Genera {len(selezionati)} PDF (ZIP)", disabled=not selezionati):
+            barra = st.progress(0.0, text="Generazione documenti...")
+            try:
+                archivio = documenti_preventivi.genera_zip(
+                    selezionati, list(clienti_per_nome.values()),
+                    progresso=lambda fatti, totale: barra.progress(fatti / totale, text=f"Documenti: {fatti}/{totale}"))
+            except Exception as e:
+                st.error(f"❌ Errore nella generazione dei PDF: {e}")
+            else:
+                st.download_button("Scarica Archivio ZIP", archivio.read(),
+                                   file_name=documenti_preventivi.nome_archivio(),
+                                   mime="application/zip", type="primary")
+    else:
+        st.info("Nessun preventivo creato. Crea il primo preventivo!")
+
+@st.fragment
+def report_finanziario():
+    # Le modifiche fatte fuori da questo processo entrano al più tardi dopo SCADENZA_LETTURE secondi
+    rollup.ricarica(db, scadenza=SCADENZA_LETTURE, coda=coda)
+    if rollup.vuoto():
+        st.info("Aggiungi alcuni dati per generare reports!")
+        return
+
+    prima_data, ultima_data = rollup.intervallo()
+
+    # Filtri del report
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        periodo_scelto = st.date_input("Periodo", value=(prima_data, max(ultima_data, datetime.now().date())))
+    with col2:
+        granularita = st.selectbox("Raggruppa per", list(PERIODI.keys()))
+    with col3:
+        cliente_report = st.selectbox("Cliente", ["Tutti"] + rollup.valori("cliente"))
+
+    if len(periodo_scelto) == 2:
+        inizio, fine = periodo_scelto
+    else:
+        inizio = fine = periodo_scelto[0]
+    dimensione, valore = ("cliente", cliente_report) if cliente_report != "Tutti" else (None, None)
+
+    # Confronto con il periodo precedente di pari durata
+    durata = fine - inizio + timedelta(days=1)
+    totali = rollup.totali(inizio, fine, dimensione, valore)
+    precedenti = rollup.totali(inizio - durata, inizio - timedelta(days=1), dimensione, valore)
+
+    entrate, pipeline, uscite = totali["entrate"], totali["pipeline"], totali["uscite"]
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Entrate Confermate", f"€{entrate:,.2f}", delta=f"€{entrate - precedenti['entrate']:,.2f}")
+    with col2:
+        st.metric("Pipeline", f"€{pipeline:,.2f}", delta=f"€{pipeline - precedenti['pipeline']:,.2f}")
+    with col3:
+        st.metric("Spese Totali", f"€{uscite:,.2f}", delta=f"€{uscite - precedenti['uscite']:,.2f}",
+                  delta_color="inverse")
+
+    # Report riassuntivo
+    st.subheader("Report Finanziario")
+    utile = entrate - uscite
+    st.metric("Utile Stimato", f"€{utile:,.2f}", delta=f"{(utile/entrate*100):.1f}%" if entrate > 0 else "0%")
+
+    # Andamento entrate vs spese
+    df_trend = rollup.serie(inizio, fine, PERIODI[granularita], dimensione, valore)
+    fig_trend = go.Figure()
+    fig_trend.add_trace(go.Bar(x=df_trend.index, y=df_trend["entrate"], name="Entrate"))
+    fig_trend.add_trace(go.Bar(x=df_trend.index, y=df_trend["uscite"], name="Spese"))
+    fig_trend.add_trace(go.Scatter(x=df_trend.index, y=df_trend["utile"], name="Utile", mode="lines+markers"))
+    fig_trend.update_layout(title=f"Entrate vs Spese per {granularita}", barmode="group")
+    st.plotly_chart(fig_trend, use_container_width=True)
+
+    st.dataframe(df_trend, use_container_width=True)
+
+    st.download_button("Esporta Report (CSV)", df_trend.to_csv().encode("utf-8"),
+                       file_name=f"report_{inizio:%Y%m%d}_{fine:%Y%m%d}.csv", mime="text/csv")
+
+@st.fragment
+def previsione_flussi():
+    st.subheader("Previsione Flussi di Cassa")
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        orizzonte = st.number_input("Orizzonte (giorni)", min_value=7, max_value=3650, value=90, step=1)
+    with col2:
+        frequenza = st.selectbox("Dettaglio", list(FREQUENZE.keys()))
+    with col3:
+        saldo_iniziale = st.number_input("Saldo di cassa attuale €", value=0.0, step=100.0)
+
+    previsione = st.session_state.previsione_cassa
+    preventivi = leggi("preventivi")
+    df_cassa = previsione.prevedi(leggi("scadenze"), preventivi, leggi("spese"), orizzonte=int(orizzonte),
+                                  frequenza=FREQUENZE[frequenza], saldo_iniziale=saldo_iniziale)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Entrate Previste", f"€{df_cassa['entrate'].sum():,.2f}")
+    with col2:
+        st.metric("Uscite Previste", f"€{df_cassa['uscite'].sum():,.2f}")
+    with col3:
+        st.metric("Saldo a Fine Periodo", f"€{df_cassa['saldo'].iloc[-1]:,.2f}",
+                  delta=f"€{df_cassa['netto'].sum():,.2f}")
+    st.caption(f"Pipeline pesata con un tasso di accettazione storico del "
+               f"{previsione.tasso_accettazione(preventivi) * 100:.0f}%")
+
+    fig_cassa = go.Figure()
+    fig_cassa.add_trace(go.Bar(x=df_cassa.index, y=df_cassa["entrate"], name="Entrate"))
+    fig_cassa.add_trace(go.Bar(x=df_cassa.index, y=-df_cassa["uscite"], name="Uscite"))
+    fig_cassa.add_trace(go.Scatter(x=df_cassa.index, y=df_cassa["saldo"], name="Saldo", mode="lines"))
+    fig_cassa.update_layout(title=f"Flussi di cassa nei prossimi {int(orizzonte)} giorni", barmode="relative")
+    st.plotly_chart(fig_cassa, use_container_width=True)
+
+    st.dataframe(df_cassa, use_container_width=True)
+
+    st.download_button("Esporta Previsione (CSV)", df_cassa.to_csv().encode("utf-8"),
+                       file_name=f"previsione_cassa_{datetime.now():%Y%m%d}.csv", mime="text/csv")
+
+@st.fragment
+def form_spesa():
+    st.subheader("Nuova Spesa")
+
+    with st.form("form_spesa"):
+        col1, col2 = st.columns(2)
+
+        with col1:
+            data_spesa = st.date_input("Data Spesa", value=datetime.now())
+            categoria = st.selectbox("Categoria",
+                                   ["Trasporti", "Materiali", "Formazione", "Ufficio",
+                                    "Software", "Hardware", "Consulenze", "Marketing", "Altro"])
+            importo = st.number_input("Importo €", min_value=0.0, step=0.01)
+
+        with col2:
+            progetti_disponibili = ["Generale"]
+            preventivi = leggi("preventivi")
+            if preventivi:
+                progetti_disponibili.extend([p["numero"] for p in preventivi])
+
+            progetto = st.selectbox("Progetto/Preventivo", progetti_disponibili)
+            detraibile = st.checkbox("Detraibile/Deducibile", value=True)
+            ricevuta = st.selectbox("Ricevuta", ["Si", "No"])
+
+        descrizione = st.text_area("Descrizione Spesa")
+
+        if st.form_submit_button("Aggiungi Spesa", type="primary"):
+            if importo > 0 and descrizione:
+                nuova_spesa = {
+                    "data": data_spesa.strftime("%d/%m/%Y"),
+                    "categoria": categoria,
+                    "descrizione": descrizione,
+                    "importo": importo,
+                    "progetto": progetto,
+                    "detraibile": detraibile,
+                    "ricevuta": ricevuta
+                }
+                if salva("spese", nuova_spesa):
+                    st.success(f"Spesa di €{importo:.2f} aggiunta con successo!")
+                    segna_modificata("spese")
+                    st.rerun()
+                else:
+                    st.error("Errore nell'aggiungere la spesa")
+            else:
+                st.error("Importo e descrizione sono obbligatori!")
+
+@st.fragment
+def lista_spese():
+    st.subheader("Lista Spese")
+
+    spese = leggi("spese")
+    if spese:
+        df_spese = pd.DataFrame(spese)
+
+        # Metriche principali
+        col1, col2, col3 = st.columns(3)
+        totale_spese = df_spese['importo'].sum()
+        spese_detraibili = df_spese[df_spese['detraibile'] == True]['importo'].sum()
+        num_spese = len(df_spese)
+
+        with col1:
+            st.metric("Totale Spese", f"€{totale_spese:.2f}")
+        with col2:
+            st.metric("Spese Detraibili", f"€{spese_detraibili:.2f}")
+        with col3:
+            st.metric("Numero Spese", num_spese)
+
+        # Tabella
+        st.subheader("Dettaglio Spese")
+        st.dataframe(df_spese, use_container_width=True)
+
+        # Grafici
+        col1, col2 = st.columns(2)
+
+        with col1:
+            spese_categoria = df_spese.groupby('categoria')['importo'].sum().reset_index()
+            fig_cat = px.pie(spese_categoria, values='importo', names='categoria',
+                           title="Spese per Categoria")
+            st.plotly_chart(fig_cat, use_container_width=True)
+
+        with col2:
+            spese_progetto = df_spese.groupby('progetto')['importo'].sum().reset_index()
+            fig_proj = px.bar(spese_progetto, x='progetto', y='importo',
+                            title="Spese per Progetto")
+            st.plotly_chart(fig_proj, use_container_width=True)
+    else:
+        st.info("Nessuna spesa registrata. Aggiungi la prima spesa!")
+
+@st.fragment
+def form_scadenza():
+    st.subheader("Nuova Scadenza")
+
+    with st.form("form_scadenza"):
+        col1, col2 = st.columns(2)
+
+        with col1:
+            titolo = st.text_input("Titolo Scadenza *")
+            data_scadenza = st.date_input("Data Scadenza", value=datetime.now())
+            tipo_scadenza = st.selectbox("Tipo",
+                                       ["Preventivo", "Pagamento", "Contratto",
+                                        "Certificazione", "Rinnovo", "Appuntamento", "Altro"])
+
+        with col2:
+            clienti = leggi("clienti")
+            clienti_disponibili = ["Nessuno"]
+            if clienti:
+                clienti_disponibili.extend([c["nome"] for c in clienti])
+            cliente_collegato = st.selectbox("Cliente Collegato", clienti_disponibili)
+
+            preventivi = leggi("preventivi")
+            preventivi_disponibili = ["Nessuno"]
+            if preventivi:
+                preventivi_disponibili.extend([p["numero"] for p in preventivi])
+            preventivo_collegato = st.selectbox("Preventivo Collegato", preventivi_disponibili)
+
+            priorita = st.selectbox("Priorità", ["Alta", "Media", "Bassa"])
+
+        descrizione = st.text_area("Descrizione/Note")
+        importo = st.number_input("Importo (se applicabile) €", min_value=0.0, step=0.01)
+
+        if st.form_submit_button("Aggiungi Scadenza", type="primary"):
+            if titolo:
+                nuova_scadenza = {
+                    "titolo": titolo,
+                    "data": data_scadenza.strftime("%d/%m/%Y"),
+                    "tipo": tipo_scadenza,
+                    "cliente": cliente_collegato if cliente_collegato != "Nessuno" else "",
+                    "preventivo": preventivo_collegato if preventivo_collegato != "Nessuno" else "",
+                    "priorita": priorita,
+                    "descrizione": descrizione,
+                    "importo": importo,
+                    "stato": "Attiva"
+                }
+                if salva("scadenze", nuova_scadenza):
+                    st.success(f"Scadenza '{titolo}' aggiunta con successo!")
+                    segna_modificata("scadenze")
+                    st.rerun()
+                else:
+                    st.error("Errore nell'aggiungere la scadenza")
+            else:
+                st.error("Il titolo è obbligatorio!")
+
+@st.fragment
+def lista_scadenze():
+    st.subheader("Lista Scadenze")
+
+    scadenze = leggi("scadenze")
+    if scadenze:
+        # Calcola statistiche
+        scadute = urgenti = prossime = future = 0
+
+        for scadenza in scadenze:
+            try:
+                data_scad = datetime.strptime(scadenza["data"], "%d/%m/%Y").date()
+                giorni = (data_scad - datetime.now().date()).days
+
+                if giorni < 0:
+                    scadute += 1
+                elif giorni <= 3:
+                    urgenti += 1
+                elif giorni <= 7:
+                    prossime += 1
+                else:
+                    future += 1
+            except:
+                continue
+
+        # Dashboard scadenze
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("🔴 Scadute", scadute)
+        with col2:
+            st.metric("🟠 Urgenti (≤3gg)", urgenti)
+        with col3:
+            st.metric("🟡 Prossime (4-7gg)", prossime)
+        with col4:
+            st.metric("🟢 Future (>7gg)", future)
+
+        # Lista scadenze
+        st.subheader("Dettaglio Scadenze")
+        for scadenza in scadenze:
+            try:
+                data_scad = datetime.strptime(scadenza["data"], "%d/%m/%Y").date()
+                giorni = (data_scad - datetime.now().date()).days
+
+                if giorni < 0:
+                    color = "🔴"
+                    status = "SCADUTA"
+                elif giorni <= 3:
+                    color = "🟠"
+                    status = "URGENTE"
+                elif giorni <= 7:
+                    color = "🟡"
+                    status = "ATTENZIONE"
+                else:
+                    color = "🟢"
+                    status = "OK"
+
+                with st.expander(f"{color} {scadenza['titolo']} - {status} ({giorni} giorni)"):
+                    st.write(f"**Data:** {scadenza['data']}")
+                    st.write(f"**Tipo:** {scadenza['tipo']}")
+                    st.write(f"**Priorità:** {scadenza['priorita']}")
+                    if scadenza['cliente']:
+                        st.write(f"**Cliente:** {scadenza['cliente']}")
+                    if scadenza['preventivo']:
+                        st.write(f"**Preventivo:** {scadenza['preventivo']}")
+                    if scadenza['importo'] > 0:
+                        st.write(f"**Importo:** €{scadenza['importo']:.2f}")
+                    if scadenza['descrizione']:
+                        st.write(f"**Note:** {scadenza['descrizione']}")
+            except:
+                st.write(f"Errore: {scadenza['titolo']}")
+    else:
+        st.info("Nessuna scadenza registrata. Aggiungi la prima scadenza!")
+
+@st.fragment
+def form_evento():
+    st.subheader("Nuovo Evento Calendario")
+
+    with st.form("form_evento"):
+        col1, col2 = st.columns(2)
+
+        with col1:
+            titolo_evento = st.text_input("Titolo Evento *")
+            data_evento = st.date_input("Data Evento", value=datetime.now())
+            ora_inizio = st.time_input("Ora Inizio", value=datetime.now().time())
+            ora_fine = st.time_input("Ora Fine", value=datetime.now().time())
+
+        with col2:
+            tipo_evento = st.selectbox("Tipo Evento",
+                                     ["Appuntamento", "Sopralluogo", "Consegna",
+                                      "Riunione", "Deadline", "Formazione", "Altro"])
+
+            clienti = leggi("clienti")
+            clienti_disponibili = ["Nessuno"]
+            if clienti:
+                clienti_disponibili.extend([c["nome"] for c in clienti])
+            cliente_evento = st.selectbox("Cliente Collegato", clienti_disponibili)
+
+            preventivi = leggi("preventivi")
+            preventivi_disponibili = ["Nessuno"]
+            if preventivi:
+                preventivi_disponibili.extend([p["numero"] for p in preventivi])
+            preventivo_evento = st.selectbox("Preventivo Collegato", preventivi_disponibili)
+
+            priorita_evento = st.selectbox("Priorità", ["Alta", "Media", "Bassa"])
+
+        luogo = st.text_input("Luogo/Indirizzo")
+        note_evento = st.text_area("Note/Descrizione")
+
+        if st.form_submit_button("Aggiungi Evento", type="primary"):
+            if titolo_evento:
+                nuovo_evento = {
+                    "titolo": titolo_evento,
+                    "data": data_evento.strftime("%d/%m/%Y"),
+                    "ora_inizio": ora_inizio.strftime("%H:%M"),
+                    "ora_fine": ora_fine.strftime("%H:%M"),
+                    "tipo": tipo_evento,
+                    "cliente": cliente_evento if cliente_evento != "Nessuno" else "",
+                    "preventivo": preventivo_evento if preventivo_evento != "Nessuno" else "",
+                    "priorita": priorita_evento,
+                    "luogo": luogo,
+                    "note": note_evento,
+                    "stato": "Programmato"
+                }
+                if salva("eventi_calendario", nuovo_evento):
+                    st.success(f"Evento '{titolo_evento}' aggiunto al calendario!")
+                    segna_modificata("eventi_calendario")
+                    st.rerun()
+                else:
+                    st.error("Errore nell'aggiungere l'evento")
+            else:
+                st.error("Il titolo dell'evento è obbligatorio!")
+
+@st.fragment
+def lista_eventi():
+    st.subheader("Lista Eventi")
+
+    eventi = leggi("eventi_calendario")
+    if eventi:
+        # Ordina eventi per data
+        try:
+            eventi_ordinati = sorted(eventi,
+                                   key=lambda x: datetime.strptime(x["data"], "%d/%m/%Y"))
+
+            for evento in eventi_ordinati:
+                # Colore priorità
+                if evento["priorita"] == "Alta":
+                    priority_color = "🔴"
+                elif evento["priorita"] == "Media":
+                    priority_color = "🟡"
+                else:
+                    priority_color = "🟢"
+
+                with st.expander(f"{priority_color} {evento['data']} - {evento['titolo']} ({evento['ora_inizio']}-{evento['ora_fine']})"):
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        st.write(f"**Tipo:** {evento['tipo']}")
+                        st.write(f"**Orario:** {evento['ora_inizio']} - {evento['ora_fine']}")
+                        st.write(f"**Priorità:** {evento['priorita']}")
+                    with col2:
+                        st.write(f"**Cliente:** {evento['cliente'] or 'N/A'}")
+                        st.write(f"**Luogo:** {evento['luogo'] or 'N/A'}")
+                        st.write(f"**Preventivo:** {evento['preventivo'] or 'N/A'}")
+
+                    if evento['note']:
+                        st.write(f"**Note:** {evento['note']}")
+        except:
+            st.error("Errore nel visualizzare eventi")
+    else:
+        st.info("Nessun evento programmato. Aggiungi il primo evento!")
+
+@st.fragment
+def importazione_dati():
+    tabella = st.selectbox("Tabella di destinazione", list(SCHEMI.keys()),
+                           format_func=lambda t: SCHEMI[t]["etichetta"])
+    schema = SCHEMI[tabella]
+    st.caption(f"Colonne: {', '.join(schema['colonne'])} — obbligatorie: {', '.join(schema['obbligatori'])}")
+
+    if not schema["chiave"]:
+        st.warning(f"⚠️ Le {schema['etichetta'].lower()} non hanno una chiave univoca: reimportare righe già "
+                   "salvate le duplica. Se l'importazione si interrompe riprendila dalla riga indicata; "
+                   "le righe scartate vanno reimportate dal report errori, non dal file originale.")
+
+    file_import = st.file_uploader("File da importare", type=["csv", "xlsx"])
+    riga_iniziale = st.number_input("Importa a partire dalla riga", min_value=2, value=2, step=1,
+                                    help="La riga 1 è l'intestazione. Serve per riprendere un'importazione interrotta.")
+
+    if file_import and st.button("Avvia Importazione", type="primary"):
+        barra = st.progress(0.0, text="Lettura file...")
+        ultimo_esito = []
+
+        def aggiorna_progresso(esito):
+            ultimo_esito[:] = [esito]
+            barra.progress(esito.avanzamento,
+                           text=f"Righe lette: {esito.righe_lette} — importate: {esito.righe_importate} "
+                                f"— scartate: {esito.righe_scartate}")
+
+        try:
+            esito = importa_file(db, tabella, file_import, file_import.name, progresso=aggiorna_progresso,
+                                 al_salvataggio=rollup.aggiungi, riga_iniziale=int(riga_iniziale))
+        except Exception as e:
+            st.error(f"❌ Errore durante l'importazione: {e}")
+            if ultimo_esito:
+                parziale = ultimo_esito[0]
+                st.info(f"Righe già importate: {parziale.righe_importate}. Per riprendere senza duplicati "
+                        f"reimporta lo stesso file a partire dalla riga {parziale.riga_ripresa}.")
+                if parziale.righe_scartate:
+                    st.download_button("Scarica Report Errori (CSV)",
+                                       parziale.report_errori().to_csv(index=False).encode("utf-8"),
+                                       file_name=f"errori_importazione_{tabella}.csv", mime="text/csv")
+            if ultimo_esito and ultimo_esito[0].righe_importate:
+                segna_modificata(tabella)
+        else:
+            barra.progress(1.0, text="Importazione completata")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Righe Lette", esito.righe_lette)
+            with col2:
+                st.metric("Righe Importate", esito.righe_importate)
+            with col3:
+                st.metric("Righe Scartate", esito.righe_scartate)
+
+            if esito.righe_scartate:
+                report = esito.report_errori()
+                st.subheader("Report Errori")
+                st.dataframe(report.head(1000), use_container_width=True)
+                st.download_button("Scarica Report Errori (CSV)", report.to_csv(index=False).encode("utf-8"),
+                                   file_name=f"errori_importazione_{tabella}.csv", mime="text/csv")
+            else:
+                st.success("✅ Tutte le righe sono state importate")
+
+            if esito.righe_importate:
+                segna_modificata(tabella)
+
 # DASHBOARD
 if menu == "Dashboard":
     st.header("📊 Dashboard Principale")
-    
+
+    preventivi = leggi("preventivi")
+
     # Calcola statistiche
-    total_preventivi, total_clienti, valore_accettato, tasso_successo = calcola_statistiche()
-    
+    total_preventivi, total_clienti, valore_accettato, tasso_successo = calcola_statistiche(preventivi, leggi("clienti"))
+
     # Metriche principali
     col1, col2, col3, col4 = st.columns(4)
-    
+
     with col1:
         st.metric("Preventivi Totali", total_preventivi)
-    
+
     with col2:
         st.metric("Clienti Attivi", total_clienti)
-    
+
     with col3:
         st.metric("Valore Accettato", f"€{valore_accettato:,.0f}")
-    
+
     with col4:
         st.metric("Tasso Successo", f"{tasso_successo:.0f}%")
-    
+
     # Grafico se ci sono dati
-    if st.session_state.preventivi:
+    if preventivi:
         st.subheader("Preventivi per Stato")
-        df_stati = pd.DataFrame(st.session_state.preventivi)
+        df_stati = pd.DataFrame(preventivi)
         fig_stati = px.pie(df_stati, names='stato', title="Distribuzione Stati")
         st.plotly_chart(fig_stati, use_container_width=True)
 
 # GESTIONE CLIENTI
 elif menu == "Gestione Clienti":
     st.header("👥 Gestione Clienti")
-    
+
     # Tabs per organizzare
     tab1, tab2 = st.tabs(["Aggiungi Cliente", "Lista Clienti"])
-    
+
     with tab1:
-        st.subheader("Nuovo Cliente")
-        
-        with st.form("form_cliente"):
-            nome = st.text_input("Nome/Ragione Sociale *")
-            email = st.text_input("Email")
-            telefono = st.text_input("Telefono")
-            note = st.text_area("Note Personali")
-            
-            if st.form_submit_button("Aggiungi Cliente", type="primary"):
-                if nome:
-                    nuovo_cliente = {
-                        "nome": nome,
-                        "email": email,
-                        "telefono": telefono,
-                        "note": note,
-                        "data_creazione": datetime.now().strftime("%d/%m/%Y")
-                    }
-                    if db.add_cliente(nuovo_cliente):
-                        st.success(f"Cliente '{nome}' aggiunto con successo!")
-                        st.session_state.clienti = db.get_clienti()
-                        st.rerun()
-                    else:
-                        st.error("Errore nell'aggiungere il cliente")
-                else:
-                    st.error("Il nome è obbligatorio!")
-    
+        form_cliente()
+
     with tab2:
-        st.subheader("Lista Clienti")
-        
-        # Carica clienti dal database
-        st.session_state.clienti = db.get_clienti()
-        
-        if st.session_state.clienti:
-            df_clienti = pd.DataFrame(st.session_state.clienti)
-            st.dataframe(df_clienti, use_container_width=True)
-        else:
-            st.info("Nessun cliente registrato. Aggiungi il primo cliente!")
+        lista_clienti()
 
 # GESTIONE PREVENTIVI
 elif menu == "Gestione Preventivi":
     st.header("📄 Gestione Preventivi")
-    
+
     tab1, tab2 = st.tabs(["Crea Preventivo", "Lista Preventivi"])
-    
+
     with tab1:
-        st.subheader("Nuovo Preventivo")
-        
-        # Carica clienti dal database
-        st.session_state.clienti = db.get_clienti()
-        
-        if not st.session_state.clienti:
-            st.warning("Prima devi aggiungere almeno un cliente!")
-        else:
-            with st.form("form_preventivo"):
-                numero = st.text_input("Numero Preventivo *")
-                cliente = st.selectbox("Cliente *", [c["nome"] for c in st.session_state.clienti])
-                note = st.text_area("Note per Cliente")
-                totale = st.number_input("Valore Totale €", min_value=0.0, step=0.01)
-                
-                if st.form_submit_button("Crea Preventivo", type="primary"):
-                    if numero and cliente:
-                        nuovo_preventivo = {
-                            "numero": numero,
-                            "cliente": cliente,
-                            "note": note,
-                            "stato": "BOZZA",
-                            "data_creazione": datetime.now().strftime("%d/%m/%Y"),
-                            "totale": totale
-                        }
-                        if db.add_preventivo(nuovo_preventivo):
-                            st.success(f"Preventivo '{numero}' creato con successo!")
-                            st.session_state.preventivi = db.get_preventivi()
-                            st.rerun()
-                        else:
-                            st.error("Errore nel creare il preventivo")
-                    else:
-                        st.error("Numero preventivo e cliente sono obbligatori!")
-    
+        form_preventivo()
+
     with tab2:
-        st.subheader("Lista Preventivi")
-        
-        # Carica preventivi dal database
-        st.session_state.preventivi = db.get_preventivi()
-        
-        if st.session_state.preventivi:
-            df_preventivi = pd.DataFrame(st.session_state.preventivi)
-            st.dataframe(df_preventivi, use_container_width=True)
-        else:
-            st.info("Nessun preventivo creato. Crea il primo preventivo!")
+        lista_preventivi()
 
 # ANALYTICS
 elif menu == "Analytics":
     st.header("📈 Analytics Avanzate")
-    
-    preventivi = db.get_preventivi()
-    spese = db.get_spese()
-    
+
+    preventivi = leggi("preventivi")
+
     if not preventivi:
         st.info("Carica alcuni preventivi per vedere le analytics!")
     else:
         df_preventivi = pd.DataFrame(preventivi)
-        
+
         col1, col2 = st.columns(2)
-        
+
         with col1:
             # Preventivi per stato
             stati_count = df_preventivi['stato'].value_counts()
             fig_stati = px.pie(values=stati_count.values, names=stati_count.index,
                               title="Distribuzione Preventivi per Stato")
             st.plotly_chart(fig_stati, use_container_width=True)
-        
+
         with col2:
             # Valore per cliente
             if 'totale' in df_preventivi.columns:
@@ -212,373 +828,62 @@ elif menu == "Analytics":
                                    title="Valore Totale per Cliente")
                 st.plotly_chart(fig_clienti, use_container_width=True)
 
-# REPORTS & EXPORT  
+# REPORTS & EXPORT
 elif menu == "Reports & Export":
     st.header("📊 Reports & Export")
-    
-    preventivi = db.get_preventivi()
-    spese = db.get_spese()
-    
-    if preventivi or spese:
-        col1, col2, col3 = st.columns(3)
-        
-        # Calcola metriche
-        if preventivi:
-            df_prev = pd.DataFrame(preventivi)
-            entrate = df_prev[df_prev['stato'] == 'ACCETTATO']['totale'].sum() if 'totale' in df_prev.columns else 0
-            pipeline = df_prev[df_prev['stato'].isin(['BOZZA', 'INVIATO'])]['totale'].sum() if 'totale' in df_prev.columns else 0
-        else:
-            entrate = 0
-            pipeline = 0
-            
-        if spese:
-            df_spese = pd.DataFrame(spese)
-            uscite = df_spese['importo'].sum()
-        else:
-            uscite = 0
-        
-        with col1:
-            st.metric("Entrate Confermate", f"€{entrate:,.2f}")
-        with col2:
-            st.metric("Pipeline", f"€{pipeline:,.2f}") 
-        with col3:
-            st.metric("Spese Totali", f"€{uscite:,.2f}")
-        
-        # Report riassuntivo
-        st.subheader("Report Finanziario")
-        utile = entrate - uscite
-        st.metric("Utile Stimato", f"€{utile:,.2f}", delta=f"{(utile/entrate*100):.1f}%" if entrate > 0 else "0%")
-        
-        if st.button("Esporta Report (CSV)"):
-            st.success("Funzione export - in una versione completa genererebbe un file CSV")
-    else:
-        st.info("Aggiungi alcuni dati per generare reports!")
+
+    report_finanziario()
+
+    previsione_flussi()
 
 # AMMINISTRAZIONE
 elif menu == "Amministrazione":
     st.header("🏢 Amministrazione")
-    
+
     # Tabs per le diverse funzioni amministrative
     tab1, tab2, tab3 = st.tabs(["💼 Nota Spese", "⏰ Scadenze", "📅 Calendario"])
-    
+
     with tab1:
         st.subheader("Gestione Nota Spese")
-        
+
         # Sottotabs per organizzare meglio
         subtab1, subtab2 = st.tabs(["Aggiungi Spesa", "Lista Spese"])
-        
+
         with subtab1:
-            st.subheader("Nuova Spesa")
-            
-            with st.form("form_spesa"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    data_spesa = st.date_input("Data Spesa", value=datetime.now())
-                    categoria = st.selectbox("Categoria", 
-                                           ["Trasporti", "Materiali", "Formazione", "Ufficio", 
-                                            "Software", "Hardware", "Consulenze", "Marketing", "Altro"])
-                    importo = st.number_input("Importo €", min_value=0.0, step=0.01)
-                
-                with col2:
-                    progetti_disponibili = ["Generale"]
-                    preventivi = db.get_preventivi()
-                    if preventivi:
-                        progetti_disponibili.extend([p["numero"] for p in preventivi])
-                    
-                    progetto = st.selectbox("Progetto/Preventivo", progetti_disponibili)
-                    detraibile = st.checkbox("Detraibile/Deducibile", value=True)
-                    ricevuta = st.selectbox("Ricevuta", ["Si", "No"])
-                
-                descrizione = st.text_area("Descrizione Spesa")
-                
-                if st.form_submit_button("Aggiungi Spesa", type="primary"):
-                    if importo > 0 and descrizione:
-                        nuova_spesa = {
-                            "data": data_spesa.strftime("%d/%m/%Y"),
-                            "categoria": categoria,
-                            "descrizione": descrizione,
-                            "importo": importo,
-                            "progetto": progetto,
-                            "detraibile": detraibile,
-                            "ricevuta": ricevuta
-                        }
-                        if db.add_spesa(nuova_spesa):
-                            st.success(f"Spesa di €{importo:.2f} aggiunta con successo!")
-                            st.rerun()
-                        else:
-                            st.error("Errore nell'aggiungere la spesa")
-                    else:
-                        st.error("Importo e descrizione sono obbligatori!")
-        
+            form_spesa()
+
         with subtab2:
-            st.subheader("Lista Spese")
-            
-            spese = db.get_spese()
-            if spese:
-                df_spese = pd.DataFrame(spese)
-                
-                # Metriche principali
-                col1, col2, col3 = st.columns(3)
-                totale_spese = df_spese['importo'].sum()
-                spese_detraibili = df_spese[df_spese['detraibile'] == True]['importo'].sum()
-                num_spese = len(df_spese)
-                
-                with col1:
-                    st.metric("Totale Spese", f"€{totale_spese:.2f}")
-                with col2:
-                    st.metric("Spese Detraibili", f"€{spese_detraibili:.2f}")
-                with col3:
-                    st.metric("Numero Spese", num_spese)
-                
-                # Tabella
-                st.subheader("Dettaglio Spese")
-                st.dataframe(df_spese, use_container_width=True)
-                
-                # Grafici
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    spese_categoria = df_spese.groupby('categoria')['importo'].sum().reset_index()
-                    fig_cat = px.pie(spese_categoria, values='importo', names='categoria', 
-                                   title="Spese per Categoria")
-                    st.plotly_chart(fig_cat, use_container_width=True)
-                
-                with col2:
-                    spese_progetto = df_spese.groupby('progetto')['importo'].sum().reset_index()
-                    fig_proj = px.bar(spese_progetto, x='progetto', y='importo',
-                                    title="Spese per Progetto")
-                    st.plotly_chart(fig_proj, use_container_width=True)
-            else:
-                st.info("Nessuna spesa registrata. Aggiungi la prima spesa!")
-    
+            lista_spese()
+
     with tab2:
         st.subheader("Scadenze & Promemoria")
-        
+
         subtab1, subtab2 = st.tabs(["Aggiungi Scadenza", "Lista Scadenze"])
-        
+
         with subtab1:
-            st.subheader("Nuova Scadenza")
-            
-            with st.form("form_scadenza"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    titolo = st.text_input("Titolo Scadenza *")
-                    data_scadenza = st.date_input("Data Scadenza", value=datetime.now())
-                    tipo_scadenza = st.selectbox("Tipo", 
-                                               ["Preventivo", "Pagamento", "Contratto", 
-                                                "Certificazione", "Rinnovo", "Appuntamento", "Altro"])
-                
-                with col2:
-                    clienti = db.get_clienti()
-                    clienti_disponibili = ["Nessuno"]
-                    if clienti:
-                        clienti_disponibili.extend([c["nome"] for c in clienti])
-                    cliente_collegato = st.selectbox("Cliente Collegato", clienti_disponibili)
-                    
-                    preventivi = db.get_preventivi()
-                    preventivi_disponibili = ["Nessuno"]
-                    if preventivi:
-                        preventivi_disponibili.extend([p["numero"] for p in preventivi])
-                    preventivo_collegato = st.selectbox("Preventivo Collegato", preventivi_disponibili)
-                    
-                    priorita = st.selectbox("Priorità", ["Alta", "Media", "Bassa"])
-                
-                descrizione = st.text_area("Descrizione/Note")
-                importo = st.number_input("Importo (se applicabile) €", min_value=0.0, step=0.01)
-                
-                if st.form_submit_button("Aggiungi Scadenza", type="primary"):
-                    if titolo:
-                        nuova_scadenza = {
-                            "titolo": titolo,
-                            "data": data_scadenza.strftime("%d/%m/%Y"),
-                            "tipo": tipo_scadenza,
-                            "cliente": cliente_collegato if cliente_collegato != "Nessuno" else "",
-                            "preventivo": preventivo_collegato if preventivo_collegato != "Nessuno" else "",
-                            "priorita": priorita,
-                            "descrizione": descrizione,
-                            "importo": importo,
-                            "stato": "Attiva"
-                        }
-                        if db.add_scadenza(nuova_scadenza):
-                            st.success(f"Scadenza '{titolo}' aggiunta con successo!")
-                            st.rerun()
-                        else:
-                            st.error("Errore nell'aggiungere la scadenza")
-                    else:
-                        st.error("Il titolo è obbligatorio!")
-        
+            form_scadenza()
+
         with subtab2:
-            st.subheader("Lista Scadenze")
-            
-            scadenze = db.get_scadenze()
-            if scadenze:
-                # Calcola statistiche
-                scadute = urgenti = prossime = future = 0
-                
-                for scadenza in scadenze:
-                    try:
-                        data_scad = datetime.strptime(scadenza["data"], "%d/%m/%Y").date()
-                        giorni = (data_scad - datetime.now().date()).days
-                        
-                        if giorni < 0:
-                            scadute += 1
-                        elif giorni <= 3:
-                            urgenti += 1
-                        elif giorni <= 7:
-                            prossime += 1
-                        else:
-                            future += 1
-                    except:
-                        continue
-                
-                # Dashboard scadenze
-                col1, col2, col3, col4 = st.columns(4)
-                with col1:
-                    st.metric("🔴 Scadute", scadute)
-                with col2:
-                    st.metric("🟠 Urgenti (≤3gg)", urgenti)
-                with col3:
-                    st.metric("🟡 Prossime (4-7gg)", prossime)
-                with col4:
-                    st.metric("🟢 Future (>7gg)", future)
-                
-                # Lista scadenze
-                st.subheader("Dettaglio Scadenze")
-                for scadenza in scadenze:
-                    try:
-                        data_scad = datetime.strptime(scadenza["data"], "%d/%m/%Y").date()
-                        giorni = (data_scad - datetime.now().date()).days
-                        
-                        if giorni < 0:
-                            color = "🔴"
-                            status = "SCADUTA"
-                        elif giorni <= 3:
-                            color = "🟠"
-                            status = "URGENTE"
-                        elif giorni <= 7:
-                            color = "🟡"
-                            status = "ATTENZIONE"
-                        else:
-                            color = "🟢"
-                            status = "OK"
-                        
-                        with st.expander(f"{color} {scadenza['titolo']} - {status} ({giorni} giorni)"):
-                            st.write(f"**Data:** {scadenza['data']}")
-                            st.write(f"**Tipo:** {scadenza['tipo']}")
-                            st.write(f"**Priorità:** {scadenza['priorita']}")
-                            if scadenza['cliente']:
-                                st.write(f"**Cliente:** {scadenza['cliente']}")
-                            if scadenza['preventivo']:
-                                st.write(f"**Preventivo:** {scadenza['preventivo']}")
-                            if scadenza['importo'] > 0:
-                                st.write(f"**Importo:** €{scadenza['importo']:.2f}")
-                            if scadenza['descrizione']:
-                                st.write(f"**Note:** {scadenza['descrizione']}")
-                    except:
-                        st.write(f"Errore: {scadenza['titolo']}")
-            else:
-                st.info("Nessuna scadenza registrata. Aggiungi la prima scadenza!")
-    
+            lista_scadenze()
+
     with tab3:
         st.subheader("📅 Calendario Lavori")
-        
+
         subtab1, subtab2 = st.tabs(["Aggiungi Evento", "Vista Eventi"])
-        
+
         with subtab1:
-            st.subheader("Nuovo Evento Calendario")
-            
-            with st.form("form_evento"):
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    titolo_evento = st.text_input("Titolo Evento *")
-                    data_evento = st.date_input("Data Evento", value=datetime.now())
-                    ora_inizio = st.time_input("Ora Inizio", value=datetime.now().time())
-                    ora_fine = st.time_input("Ora Fine", value=datetime.now().time())
-                
-                with col2:
-                    tipo_evento = st.selectbox("Tipo Evento", 
-                                             ["Appuntamento", "Sopralluogo", "Consegna", 
-                                              "Riunione", "Deadline", "Formazione", "Altro"])
-                    
-                    clienti = db.get_clienti()
-                    clienti_disponibili = ["Nessuno"]
-                    if clienti:
-                        clienti_disponibili.extend([c["nome"] for c in clienti])
-                    cliente_evento = st.selectbox("Cliente Collegato", clienti_disponibili)
-                    
-                    preventivi = db.get_preventivi()
-                    preventivi_disponibili = ["Nessuno"]
-                    if preventivi:
-                        preventivi_disponibili.extend([p["numero"] for p in preventivi])
-                    preventivo_evento = st.selectbox("Preventivo Collegato", preventivi_disponibili)
-                    
-                    priorita_evento = st.selectbox("Priorità", ["Alta", "Media", "Bassa"])
-                
-                luogo = st.text_input("Luogo/Indirizzo")
-                note_evento = st.text_area("Note/Descrizione")
-                
-                if st.form_submit_button("Aggiungi Evento", type="primary"):
-                    if titolo_evento:
-                        nuovo_evento = {
-                            "titolo": titolo_evento,
-                            "data": data_evento.strftime("%d/%m/%Y"),
-                            "ora_inizio": ora_inizio.strftime("%H:%M"),
-                            "ora_fine": ora_fine.strftime("%H:%M"),
-                            "tipo": tipo_evento,
-                            "cliente": cliente_evento if cliente_evento != "Nessuno" else "",
-                            "preventivo": preventivo_evento if preventivo_evento != "Nessuno" else "",
-                            "priorita": priorita_evento,
-                            "luogo": luogo,
-                            "note": note_evento,
-                            "stato": "Programmato"
-                        }
-                        if db.add_evento_calendario(nuovo_evento):
-                            st.success(f"Evento '{titolo_evento}' aggiunto al calendario!")
-                            st.rerun()
-                        else:
-                            st.error("Errore nell'aggiungere l'evento")
-                    else:
-                        st.error("Il titolo dell'evento è obbligatorio!")
-        
+            form_evento()
+
         with subtab2:
-            st.subheader("Lista Eventi")
-            
-            eventi = db.get_eventi_calendario()
-            if eventi:
-                # Ordina eventi per data
-                try:
-                    eventi_ordinati = sorted(eventi, 
-                                           key=lambda x: datetime.strptime(x["data"], "%d/%m/%Y"))
-                    
-                    for evento in eventi_ordinati:
-                        # Colore priorità
-                        if evento["priorita"] == "Alta":
-                            priority_color = "🔴"
-                        elif evento["priorita"] == "Media":
-                            priority_color = "🟡"
-                        else:
-                            priority_color = "🟢"
-                        
-                        with st.expander(f"{priority_color} {evento['data']} - {evento['titolo']} ({evento['ora_inizio']}-{evento['ora_fine']})"):
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.write(f"**Tipo:** {evento['tipo']}")
-                                st.write(f"**Orario:** {evento['ora_inizio']} - {evento['ora_fine']}")
-                                st.write(f"**Priorità:** {evento['priorita']}")
-                            with col2:
-                                st.write(f"**Cliente:** {evento['cliente'] or 'N/A'}")
-                                st.write(f"**Luogo:** {evento['luogo'] or 'N/A'}")
-                                st.write(f"**Preventivo:** {evento['preventivo'] or 'N/A'}")
-                            
-                            if evento['note']:
-                                st.write(f"**Note:** {evento['note']}")
-                except:
-                    st.error("Errore nel visualizzare eventi")
-            else:
-                st.info("Nessun evento programmato. Aggiungi il primo evento!")
+            lista_eventi()
+
+# IMPORTAZIONE DATI
+elif menu == "Importazione Dati":
+    st.header("📥 Importazione Dati")
+    st.markdown("Carica un file CSV o Excel con una riga per record. "
+                "Le intestazioni devono corrispondere ai campi della tabella scelta.")
+
+    importazione_dati()
 
 # DEMO
 elif menu == "Demo":
@@ -758,8 +1063,8 @@ elif menu == "Demo":
             db.add_evento_calendario(evento_demo3)
             
             # Aggiorna session state
-            st.session_state.clienti = db.get_clienti()
-            st.session_state.preventivi = db.get_preventivi()
+            segna_modificata()
+            rollup.ricarica(db, coda=coda)
             
             st.success("✅ Dati demo completi caricati con successo!")
             st.info("Ora puoi esplorare tutte le sezioni: Dashboard, Analytics, Amministrazione (Spese, Scadenze, Calendario), Reports")
@@ -772,9 +1077,12 @@ elif menu == "Demo":
     st.markdown("### Gestione Dati")
     
     if st.button("🔄 Ricarica Dati dal Database"):
-        st.session_state.clienti = db.get_clienti()
-        st.session_state.preventivi = db.get_preventivi()
-        st.success(f"✅ Ricaricati: {len(st.session_state.clienti)} clienti, {len(st.session_state.preventivi)} preventivi")
+        segna_modificata()
+        clienti = leggi("clienti")
+        preventivi = leggi("preventivi")
+        # Dal database e non da leggi(): le scritture ancora in coda entrano nel rollup alla conferma
+        rollup.ricarica(db, coda=coda)
+        st.success(f"✅ Ricaricati: {len(clienti)} clienti, {len(preventivi)} preventivi")
     
     if st.button("🗑️ Elimina Tutti i Dati Demo", type="secondary"):
         st.warning("⚠️ Funzione non implementata per sicurezza. Puoi eliminare i dati manualmente da Supabase se necessario.")
@@ -0,0 +1,289 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from importazione import SCHEMI
+
+PERCORSO_PREDEFINITO = os.environ.get("TALENTO_CODA_SCRITTURE", ".talento_coda.sqlite3")
+# Per quanto tempo le scritture confermate restano sul giornale (e le loro chiavi restano riservate)
+CONSERVAZIONE_SECONDI = 7 * 24 * 3600
+
+# Stati di una scrittura nel giornale
+IN_ATTESA = "in_attesa"
+IN_INVIO = "in_invio"
+INVIATA = "inviata"
+FALLITA = "fallita"
+
+
+def _dipendenze(tabella):
+    # La tabella stessa più quelle a cui i suoi record fanno riferimento, anche indirettamente
+    tabelle = {tabella}
+    for tabella_rif, _ in SCHEMI[tabella]["riferimenti"].values():
+        tabelle |= _dipendenze(tabella_rif)
+    return tabelle
+
+
+DIPENDENZE = {tabella: _dipendenze(tabella) for tabella in SCHEMI}
+
+
+class CodaScritture:
+    """Coda di scritture verso il database, registrate prima su un giornale SQLite locale.
+
+    accoda() salva il record sul giornale e ritorna subito; un thread in background invia
+    le scritture al backend a blocchi, in ordine di arrivo, ritentando con attesa crescente.
+    Mentre una scrittura attende il nuovo tentativo, le successive della stessa tabella e
+    delle tabelle che vi fanno riferimento restano in coda dietro di lei.
+    Ogni scrittura ha una chiave univoca, controllata solo sul giornale locale: la stessa chiave
+    non viene accodata né confermata due volte. Il backend non la riceve, quindi la consegna è
+    "almeno una volta": una scrittura viene ripetuta se il processo si ferma dopo l'invio ma prima
+    della conferma sul giornale, oppure se il database la salva ma la risposta va persa (timeout,
+    add_* che restituisce False). Con upsert_batch la ripetizione aggiorna lo stesso record per
+    clienti e preventivi (chiave nome/numero); per spese, scadenze ed eventi, che non hanno
+    una chiave, e con i metodi add_* può creare un duplicato.
+    """
+
+    def __init__(self, db, percorso=PERCORSO_PREDEFINITO, dimensione_batch=100, intervallo=2.0,
+                 tentativi_massimi=8, attesa_massima=300, al_salvataggio=None):
+        self.db = db
+        # al_salvataggio(tabella, records) viene chiamato per ogni gruppo di scritture confermate
+        self.al_salvataggio = al_salvataggio
+        self.dimensione_batch = dimensione_batch
+        self.intervallo = intervallo
+        self.tentativi_massimi = tentativi_massimi
+        self.attesa_massima = attesa_massima
+
+        self._lock = threading.Lock()
+        # Tenuto per tutto l'invio di un gruppo di scritture, dalla selezione alla conferma
+        self._lock_invio = threading.Lock()
+        self._risveglio = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._generazioni = defaultdict(int)
+
+        self._conn = sqlite3.connect(percorso, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: una scrittura confermata all'utente sopravvive anche a un crash della macchina
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS scritture (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chiave TEXT NOT NULL UNIQUE,
+                tabella TEXT NOT NULL,
+                record TEXT NOT NULL,
+                stato TEXT NOT NULL DEFAULT 'in_attesa',
+                tentativi INTEGER NOT NULL DEFAULT 0,
+                prossimo_tentativo REAL NOT NULL DEFAULT 0,
+                errore TEXT,
+                creata REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_scritture_stato ON scritture (stato, id)")
+        # Scritture rimaste a metà invio dopo un arresto: tornano in coda
+        self._conn.execute("UPDATE scritture SET stato = ? WHERE stato = ?", (IN_ATTESA, IN_INVIO))
+
+    def accoda(self, tabella, record, chiave=None):
+        """Registra la scrittura sul giornale e ne restituisce la chiave."""
+        if tabella not in SCHEMI:
+            raise ValueError(f"Tabella sconosciuta: {tabella}")
+        chiave = chiave or uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO scritture (chiave, tabella, record, creata) VALUES (?, ?, ?, ?)",
+                (chiave, tabella, json.dumps(record, ensure_ascii=False, default=str), time.time()),
+            )
+        self._risveglio.set()
+        return chiave
+
+    def in_attesa(self, tabella):
+        """Record ancora da confermare dal backend, per mostrarli subito nelle letture."""
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT record FROM scritture WHERE tabella = ? AND stato IN (?, ?) ORDER BY id",
+                (tabella, IN_ATTESA, IN_INVIO),
+            ).fetchall()
+        return [json.loads(r[0]) for r in righe]
+
+    def generazione(self, tabella):
+        """Cresce ogni volta che delle scritture della tabella vengono confermate dal backend."""
+        return self._generazioni[tabella]
+
+    def conteggi(self):
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT stato, COUNT(*) FROM scritture WHERE stato != ? GROUP BY stato", (INVIATA,)
+            ).fetchall()
+        return dict(righe)
+
+    def fallite(self):
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT chiave, tabella, record, errore FROM scritture WHERE stato = ? ORDER BY id", (FALLITA,)
+            ).fetchall()
+        return [{"chiave": c, "tabella": t, "record": json.loads(r), "errore": e} for c, t, r, e in righe]
+
+    def riprova_fallite(self):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE scritture SET stato = ?, tentativi = 0, prossimo_tentativo = 0 WHERE stato = ?",
+                (IN_ATTESA, FALLITA),
+            )
+        self._risveglio.set()
+
+    def scarta_fallite(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM scritture WHERE stato = ?", (FALLITA,))
+
+    def _invia(self, tabella, blocco):
+        # Con upsert_batch il blocco viaggia in una richiesta sola; altrimenti riga per riga,
+        # così le righe già salvate non vengono rimandate se una successiva fallisce
+        upsert = getattr(self.db, "upsert_batch", None)
+        if upsert is not None:
+            if not upsert(tabella, [r for _, r in blocco], on_conflict=SCHEMI[tabella]["chiave"]):
+                raise RuntimeError("il backend ha rifiutato il blocco")
+            self._conferma(tabella, blocco)
+            return
+
+        aggiungi = getattr(self.db, SCHEMI[tabella]["metodo"])
+        for scrittura in blocco:
+            if not aggiungi(scrittura[1]):
+                raise RuntimeError("il backend ha rifiutato la scrittura")
+            self._conferma(tabella, [scrittura])
+
+    def _conferma(self, tabella, scritture):
+        with self._lock:
+            self._conn.executemany("UPDATE scritture SET stato = ?, errore = NULL WHERE id = ?",
+                                   [(INVIATA, i) for i, _ in scritture])
+            self._generazioni[tabella] += 1
+        if self.al_salvataggio:
+            self.al_salvataggio(tabella, [r for _, r in scritture])
+
+    def _rimanda(self, ids, errore):
+        with self._lock:
+            for id_scrittura in ids:
+                tentativi = self._conn.execute("SELECT tentativi FROM scritture WHERE id = ?",
+                                               (id_scrittura,)).fetchone()[0] + 1
+                stato = FALLITA if tentativi >= self.tentativi_massimi else IN_ATTESA
+                attesa = min(2 ** tentativi, self.attesa_massima)
+                self._conn.execute(
+                    "UPDATE scritture SET stato = ?, tentativi = ?, prossimo_tentativo = ?, errore = ? WHERE id = ?",
+                    (stato, tentativi, time.time() + attesa, errore, id_scrittura),
+                )
+
+    def _rilascia(self, ids):
+        # Scritture non tentate: tornano in coda senza consumare tentativi
+        with self._lock:
+            self._conn.executemany("UPDATE scritture SET stato = ? WHERE id = ? AND stato = ?",
+                                   [(IN_ATTESA, i, IN_INVIO) for i in ids])
+
+    def _pronte(self, adesso):
+        # Per ogni tabella, la prima scrittura in attesa di un nuovo tentativo fa da barriera:
+        # le successive della stessa tabella e di quelle che la richiamano non possono superarla
+        bloccate = dict(self._conn.execute(
+            "SELECT tabella, MIN(id) FROM scritture WHERE stato = ? AND prossimo_tentativo > ? GROUP BY tabella",
+            (IN_ATTESA, adesso),
+        ).fetchall())
+        condizioni, parametri = [], []
+        for tabella, dipendenze in DIPENDENZE.items():
+            barriere = [bloccate[t] for t in dipendenze if t in bloccate]
+            if barriere:
+                condizioni.append("(tabella = ? AND id < ?)")
+                parametri += [tabella, min(barriere)]
+            else:
+                condizioni.append("tabella = ?")
+                parametri.append(tabella)
+        return self._conn.execute(
+            f"SELECT id, tabella, record FROM scritture WHERE stato = ? AND prossimo_tentativo <= ? "
+            f"AND ({' OR '.join(condizioni)}) ORDER BY id LIMIT ?",
+            (IN_ATTESA, adesso, *parametri, self.dimensione_batch),
+        ).fetchall()
+
+    @contextlib.contextmanager
+    def in_pausa(self):
+        """Sospende gli invii: all'interno nessuna scrittura viene inviata o confermata."""
+        with self._lock_invio:
+            yield
+
+    def svuota(self):
+        """Invia un blocco di scritture in attesa. Restituisce quante sono state confermate."""
+        with self._lock_invio:
+            return self._svuota()
+
+    def _svuota(self):
+        with self._lock:
+            righe = self._pronte(time.time())
+            if not righe:
+                return 0
+            self._conn.executemany("UPDATE scritture SET stato = ? WHERE id = ?",
+                                   [(IN_INVIO, r[0]) for r in righe])
+
+        # Raggruppo le scritture consecutive della stessa tabella, mantenendo l'ordine di arrivo:
+        # un preventivo non deve precedere il cliente a cui fa riferimento
+        blocchi = []
+        for id_scrittura, tabella, record in righe:
+            if not blocchi or blocchi[-1][0] != tabella:
+                blocchi.append((tabella, []))
+            blocchi[-1][1].append((id_scrittura, json.loads(record)))
+
+        confermate = 0
+        tabelle_fallite = set()
+        for tabella, blocco in blocchi:
+            ids = [i for i, _ in blocco]
+            if DIPENDENZE[tabella] & tabelle_fallite:
+                # Potrebbero dipendere da una scrittura appena fallita: aspettano il suo nuovo tentativo
+                self._rilascia(ids)
+                continue
+            try:
+                self._invia(tabella, blocco)
+                confermate += len(blocco)
+            except Exception as e:
+                tabelle_fallite.add(tabella)
+                non_confermate = self._ids_in_invio(ids)
+                # Con upsert_batch è stato tentato tutto il blocco, con add_* solo la prima riga non confermata
+                tentate = non_confermate if hasattr(self.db, "upsert_batch") else non_confermate[:1]
+                self._rimanda(tentate, str(e))
+                self._rilascia(non_confermate[len(tentate):])
+        return confermate
+
+    def _ids_in_invio(self, ids):
+        with self._lock:
+            segnaposto = ",".join("?" * len(ids))
+            righe = self._conn.execute(
+                f"SELECT id FROM scritture WHERE stato = ? AND id IN ({segnaposto}) ORDER BY id", (IN_INVIO, *ids)
+            ).fetchall()
+        return [r[0] for r in righe]
+
+    def pulisci(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM scritture WHERE stato = ? AND creata < ?",
+                               (INVIATA, time.time() - CONSERVAZIONE_SECONDI))
+
+    def _ciclo(self):
+        self.pulisci()
+        while not self._stop.is_set():
+            try:
+                # Continuo a svuotare finché ci sono blocchi pronti
+                while self.svuota():
+                    pass
+            except sqlite3.Error:
+                # Giornale momentaneamente non disponibile: riprovo al prossimo giro
+                pass
+            self._risveglio.wait(self.intervallo)
+            self._risveglio.clear()
+
+    def avvia(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._ciclo, name="coda-scritture", daemon=True)
+            self._thread.start()
+        return self
+
+    def ferma(self, timeout=5):
+        self._stop.set()
+        self._risveglio.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,158 @@
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+# Sotto questa soglia i documenti vengono generati nel processo corrente:
+# avviare i processi del pool costerebbe più del rendering stesso
+SOGLIA_PARALLELO = 20
+
+
+@lru_cache(maxsize=1)
+def _template():
+    """Stili e testi fissi del documento, costruiti una sola volta per processo."""
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_RIGHT
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+
+    base = getSampleStyleSheet()
+    oro = colors.HexColor("#FFA500")
+    scuro = colors.HexColor("#2c3e50")
+    return {
+        "colore_accento": oro,
+        "colore_testo": scuro,
+        "titolo": ParagraphStyle("titolo", parent=base["Title"], textColor=scuro, fontSize=20),
+        "motto": ParagraphStyle("motto", parent=base["Italic"], textColor=scuro, alignment=1),
+        "sezione": ParagraphStyle("sezione", parent=base["Heading3"], textColor=scuro, spaceBefore=12),
+        "testo": ParagraphStyle("testo", parent=base["BodyText"], textColor=scuro, leading=14),
+        "destra": ParagraphStyle("destra", parent=base["BodyText"], textColor=scuro, alignment=TA_RIGHT),
+        "totale": ParagraphStyle("totale", parent=base["Heading2"], textColor=scuro, alignment=TA_RIGHT),
+        "piede": "TALENTO AI SUITE - Documento generato automaticamente",
+    }
+
+
+def _paragrafo(testo, stile):
+    from reportlab.platypus import Paragraph
+
+    return Paragraph(escape(str(testo or "")).replace("\n", "<br/>"), stile)
+
+
+def nome_file(preventivo):
+    numero = re.sub(r"[^A-Za-z0-9_-]+", "_", str(preventivo.get("numero") or "senza_numero"))
+    return f"preventivo_{numero}.pdf"
+
+
+def genera_pdf(preventivo, cliente=None):
+    """Restituisce il PDF di un preventivo, con i dati del cliente se disponibili."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.platypus import HRFlowable, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    t = _template()
+    cliente = cliente or {"nome": preventivo.get("cliente", "")}
+    buffer = io.BytesIO()
+
+    def piede(canvas, documento):
+        canvas.saveState()
+        canvas.setFont("Helvetica", 8)
+        canvas.setFillColor(t["colore_testo"])
+        canvas.drawCentredString(A4[0] / 2, 1.2 * cm, t["piede"])
+        canvas.restoreState()
+
+    documento = SimpleDocTemplate(buffer, pagesize=A4, title=f"Preventivo {preventivo.get('numero', '')}",
+                                  leftMargin=2 * cm, rightMargin=2 * cm, topMargin=2 * cm, bottomMargin=2 * cm)
+
+    intestazione = Table(
+        [[_paragrafo(f"Preventivo N. {preventivo.get('numero', '')}", t["sezione"]),
+          _paragrafo(f"Data: {preventivo.get('data_creazione', '')}\nStato: {preventivo.get('stato', '')}",
+                     t["destra"])]],
+        colWidths=[10 * cm, 7 * cm],
+    )
+    righe_cliente = [cliente.get("nome", "")] + [cliente[c] for c in ("email", "telefono") if cliente.get(c)]
+    dati_cliente = _paragrafo("\n".join(righe_cliente), t["testo"])
+
+    tabella_cliente = Table([[_paragrafo("Cliente", t["sezione"])], [dati_cliente]], colWidths=[17 * cm])
+    tabella_cliente.setStyle(TableStyle([
+        ("BOX", (0, 0), (-1, -1), 0.5, t["colore_accento"]),
+        ("LEFTPADDING", (0, 0), (-1, -1), 8),
+    ]))
+
+    elementi = [
+        _paragrafo("TALENTO AI SUITE", t["titolo"]),
+        _paragrafo('"Non nascondere il tuo talento sotto terra"', t["motto"]),
+        Spacer(1, 0.4 * cm),
+        HRFlowable(width="100%", color=t["colore_accento"], thickness=2),
+        Spacer(1, 0.4 * cm),
+        intestazione,
+        Spacer(1, 0.4 * cm),
+        tabella_cliente,
+        _paragrafo("Descrizione", t["sezione"]),
+        _paragrafo(preventivo.get("note") or "-", t["testo"]),
+        Spacer(1, 0.8 * cm),
+        HRFlowable(width="100%", color=t["colore_accento"], thickness=1),
+        _paragrafo(f"Totale: €{float(preventivo.get('totale') or 0):,.2f}", t["totale"]),
+    ]
+    documento.build(elementi, onFirstPage=piede, onLaterPages=piede)
+    return buffer.getvalue()
+
+
+def _genera_voce(lavoro):
+    preventivo, cliente = lavoro
+    return nome_file(preventivo), genera_pdf(preventivo, cliente)
+
+
+def _riscalda():
+    # Ogni processo del pool prepara subito il template, così il primo documento non paga l'import
+    _template()
+
+
+@lru_cache(maxsize=1)
+def _pool():
+    # "spawn" evita di duplicare con fork i thread del server Streamlit
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_riscalda)
+
+
+def genera_zip(preventivi, clienti, progresso=None):
+    """Genera i PDF di tutti i preventivi e li scrive in un archivio ZIP man mano che sono pronti.
+
+    L'archivio resta in memoria finché è piccolo e passa su disco quando cresce.
+    progresso(completati, totale) viene chiamato dopo ogni documento.
+    Restituisce il file dell'archivio, riavvolto all'inizio.
+    """
+    per_nome = {c["nome"]: c for c in clienti or []}
+    lavori = [(p, per_nome.get(p.get("cliente"))) for p in preventivi]
+    archivio = tempfile.SpooledTemporaryFile(max_size=32 * 1024 * 1024)
+
+    if len(lavori) < SOGLIA_PARALLELO or (os.cpu_count() or 1) == 1:
+        risultati = map(_genera_voce, lavori)
+    else:
+        chunksize = max(1, len(lavori) // ((os.cpu_count() or 1) * 4))
+        risultati = _pool().map(_genera_voce, lavori, chunksize=chunksize)
+
+    nomi_usati = set()
+    # I PDF sono già compressi: ricomprimerli nello ZIP costerebbe CPU senza ridurre la dimensione
+    with zipfile.ZipFile(archivio, "w", zipfile.ZIP_STORED) as zip_file:
+        for completati, (nome, contenuto) in enumerate(risultati, start=1):
+            # Numeri duplicati non devono sovrascriversi nell'archivio
+            base, indice = nome, 1
+            while nome in nomi_usati:
+                indice += 1
+                nome = base.replace(".pdf", f"_{indice}.pdf")
+            nomi_usati.add(nome)
+            zip_file.writestr(nome, contenuto)
+            if progresso:
+                progresso(completati, len(lavori))
+
+    archivio.seek(0)
+    return archivio
+
+
+def nome_archivio():
+    return f"preventivi_{datetime.now():%Y%m%d_%H%M}.zip"
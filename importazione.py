@@ -0,0 +1,391 @@
+import csv
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, time
+
+import pandas as pd
+
+# Righe lette per blocco dal file e righe inviate per singola scrittura al database
+DIMENSIONE_BLOCCO = 5000
+DIMENSIONE_BATCH = 500
+
+STATI_PREVENTIVO = ["BOZZA", "INVIATO", "ACCETTATO", "RIFIUTATO"]
+VALORI_VERI = {"si", "sì", "true", "vero", "1", "x", "yes", "y"}
+
+# Struttura attesa per ogni tabella importabile.
+# "chiave" identifica il record per l'upsert, "riferimenti" indica le colonne
+# che devono puntare a clienti/preventivi esistenti (i valori in "liberi" sono sempre ammessi).
+SCHEMI = {
+    "clienti": {
+        "etichetta": "Clienti",
+        "metodo": "add_cliente",
+        "colonne": ["nome", "email", "telefono", "note", "data_creazione"],
+        "obbligatori": ["nome"],
+        "date": ["data_creazione"],
+        "importi": [],
+        "chiave": "nome",
+        "riferimenti": {},
+        "predefiniti": {"email": "", "telefono": "", "note": "", "data_creazione": None},
+    },
+    "preventivi": {
+        "etichetta": "Preventivi",
+        "metodo": "add_preventivo",
+        "colonne": ["numero", "cliente", "note", "stato", "data_creazione", "totale"],
+        "obbligatori": ["numero", "cliente"],
+        "date": ["data_creazione"],
+        "importi": ["totale"],
+        "chiave": "numero",
+        "riferimenti": {"cliente": ("clienti", [])},
+        "predefiniti": {"note": "", "stato": "BOZZA", "data_creazione": None, "totale": "0"},
+    },
+    "spese": {
+        "etichetta": "Spese",
+        "metodo": "add_spesa",
+        "colonne": ["data", "categoria", "descrizione", "importo", "progetto", "detraibile", "ricevuta"],
+        "obbligatori": ["data", "descrizione", "importo"],
+        "date": ["data"],
+        "importi": ["importo"],
+        "chiave": None,
+        "riferimenti": {"progetto": ("preventivi", ["Generale"])},
+        "predefiniti": {"categoria": "Altro", "progetto": "Generale", "detraibile": "si", "ricevuta": "Si"},
+    },
+    "scadenze": {
+        "etichetta": "Scadenze",
+        "metodo": "add_scadenza",
+        "colonne": ["titolo", "data", "tipo", "cliente", "preventivo", "priorita", "descrizione", "importo", "stato"],
+        "obbligatori": ["titolo", "data"],
+        "date": ["data"],
+        "importi": ["importo"],
+        "chiave": None,
+        "riferimenti": {"cliente": ("clienti", [""]), "preventivo": ("preventivi", [""])},
+        "predefiniti": {"tipo": "Altro", "cliente": "", "preventivo": "", "priorita": "Media",
+                        "descrizione": "", "importo": "0", "stato": "Attiva"},
+    },
+    "eventi_calendario": {
+        "etichetta": "Eventi Calendario",
+        "metodo": "add_evento_calendario",
+        "colonne": ["titolo", "data", "ora_inizio", "ora_fine", "tipo", "cliente", "preventivo",
+                    "priorita", "luogo", "note", "stato"],
+        "obbligatori": ["titolo", "data"],
+        "date": ["data"],
+        "importi": [],
+        "chiave": None,
+        "riferimenti": {"cliente": ("clienti", [""]), "preventivo": ("preventivi", [""])},
+        "predefiniti": {"ora_inizio": "09:00", "ora_fine": "10:00", "tipo": "Altro", "cliente": "",
+                        "preventivo": "", "priorita": "Media", "luogo": "", "note": "", "stato": "Programmato"},
+    },
+}
+
+
+@dataclass
+class ContestoImportazione:
+    """Nomi dei clienti e numeri dei preventivi noti, per controllare i riferimenti."""
+    clienti: set = field(default_factory=set)
+    preventivi: set = field(default_factory=set)
+
+    @classmethod
+    def da_database(cls, db):
+        return cls(
+            clienti={c["nome"] for c in db.get_clienti() or []},
+            preventivi={p["numero"] for p in db.get_preventivi() or []},
+        )
+
+    def registra(self, tabella, records):
+        # I record appena importati diventano riferimenti validi per i blocchi successivi
+        chiave = SCHEMI[tabella]["chiave"]
+        if tabella in ("clienti", "preventivi"):
+            getattr(self, tabella).update(r[chiave] for r in records)
+
+
+@dataclass
+class EsitoImportazione:
+    tabella: str
+    righe_lette: int = 0
+    righe_importate: int = 0
+    avanzamento: float = 0.0
+    blocchi_errori: list = field(default_factory=list)
+    # Prima riga del file non ancora elaborata: da qui riprende un'importazione interrotta
+    riga_ripresa: int = 2
+
+    @property
+    def righe_scartate(self):
+        return sum(len(b) for b in self.blocchi_errori)
+
+    def report_errori(self):
+        """Una riga per ogni record scartato: numero di riga nel file, motivo e valori originali."""
+        if not self.blocchi_errori:
+            return pd.DataFrame(columns=["riga", "errore"])
+        return pd.concat(self.blocchi_errori, ignore_index=True)
+
+
+def _normalizza_intestazione(nome):
+    return str(nome).strip().lower().replace(" ", "_")
+
+
+def _cella_testo(valore):
+    if valore is None:
+        return ""
+    if isinstance(valore, (datetime, date)):
+        return valore.strftime("%d/%m/%Y")
+    if isinstance(valore, time):
+        return valore.strftime("%H:%M")
+    if isinstance(valore, float):
+        # Numeri delle celle Excel: la virgola decimale evita che 1.234 venga letto come migliaia
+        return str(int(valore)) if valore.is_integer() else repr(valore).replace(".", ",")
+    return str(valore)
+
+
+def _leggi_csv(file, dimensione_blocco):
+    # Individua il separatore (virgola o punto e virgola) dalle prime righe
+    inizio = file.read(64 * 1024)
+    file.seek(0)
+    campione = inizio.decode("utf-8-sig", errors="ignore") if isinstance(inizio, bytes) else inizio
+    try:
+        separatore = csv.Sniffer().sniff(campione, delimiters=",;\t").delimiter
+    except csv.Error:
+        separatore = ","
+
+    dimensione = getattr(file, "size", None)
+    if dimensione is None and hasattr(file, "getbuffer"):
+        dimensione = file.getbuffer().nbytes
+    lettore = pd.read_csv(file, sep=separatore, dtype=str, keep_default_na=False,
+                          encoding="utf-8-sig", chunksize=dimensione_blocco)
+    for blocco in lettore:
+        frazione = min(file.tell() / dimensione, 1.0) if dimensione else 0.0
+        yield blocco, frazione
+
+
+def _leggi_excel(file, dimensione_blocco):
+    from openpyxl import load_workbook
+
+    # read_only scorre il foglio riga per riga senza caricarlo tutto in memoria
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        totale_righe = max((ws.max_row or 1) - 1, 1)
+        righe = ws.iter_rows(values_only=True)
+        intestazione = [_cella_testo(v) for v in next(righe, ())]
+        buffer = []
+        lette = 0
+        for riga in righe:
+            buffer.append([_cella_testo(v) for v in riga[:len(intestazione)]])
+            if len(buffer) == dimensione_blocco:
+                blocco = pd.DataFrame(buffer, columns=intestazione,
+                                      index=pd.RangeIndex(lette, lette + len(buffer)))
+                lette += len(buffer)
+                buffer = []
+                yield blocco, min(lette / totale_righe, 1.0)
+        if buffer:
+            yield pd.DataFrame(buffer, columns=intestazione,
+                               index=pd.RangeIndex(lette, lette + len(buffer))), 1.0
+    finally:
+        wb.close()
+
+
+def leggi_a_blocchi(file, nome_file, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """Legge un CSV o XLSX a blocchi, restituendo (DataFrame di stringhe, frazione letta)."""
+    estensione = os.path.splitext(nome_file)[1].lower()
+    if estensione in (".xlsx", ".xlsm"):
+        lettore = _leggi_excel(file, dimensione_blocco)
+    elif estensione in (".csv", ".txt"):
+        lettore = _leggi_csv(file, dimensione_blocco)
+    else:
+        raise ValueError(f"Formato file non supportato: {estensione}")
+
+    for blocco, frazione in lettore:
+        blocco.columns = [_normalizza_intestazione(c) for c in blocco.columns]
+        yield blocco, frazione
+
+
+# Formati di importo riconosciuti (senza segno, simbolo dell'euro e spazi)
+IMPORTO_SEMPLICE = r"\d+(\.\d+)?"                    # 1234 - 1234.5 - 12.50
+IMPORTO_MIGLIAIA_PUNTO = r"\d{1,3}(\.\d{3})+(,\d+)?"  # 3.000 - 1.234.567 - 1.234,56
+IMPORTO_MIGLIAIA_VIRGOLA = r"\d{1,3}(,\d{3})+\.\d+"    # 1,234.56
+IMPORTO_VIRGOLA = r"\d+,\d+"                          # 1234,56 - 1,234
+
+
+def _converti_importi(serie):
+    """Converte gli importi in numeri, restituendo (importi, maschera dei valori ambigui).
+
+    L'ultimo separatore tra punto e virgola è quello decimale; un punto seguito da gruppi
+    di tre cifre ("3.000") indica le migliaia. Valori come "1,234,567" o "1.234.56" non
+    hanno un'interpretazione sicura: restano NaN e vengono segnalati come ambigui.
+    """
+    testo = serie.str.replace("€", "", regex=False).str.replace(" ", "", regex=False)
+    negativo = testo.str.startswith("-")
+    testo = testo.str.lstrip("+-")
+
+    normalizzato = pd.Series(pd.NA, index=serie.index, dtype=object)
+    for formato, conversione in (
+        (IMPORTO_MIGLIAIA_PUNTO, lambda t: t.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)),
+        (IMPORTO_MIGLIAIA_VIRGOLA, lambda t: t.str.replace(",", "", regex=False)),
+        (IMPORTO_VIRGOLA, lambda t: t.str.replace(",", ".", regex=False)),
+        (IMPORTO_SEMPLICE, lambda t: t),
+    ):
+        # Il primo formato che corrisponde vince: "1.234" sono migliaia, non 1,234
+        maschera = normalizzato.isna() & testo.str.fullmatch(formato)
+        normalizzato = normalizzato.mask(maschera, conversione(testo))
+
+    importi = pd.to_numeric(normalizzato, errors="coerce")
+    importi = importi.where(~negativo, -importi)
+    ambigui = importi.isna() & testo.str.fullmatch(r"[\d.,]+") & testo.str.contains(r"[.,]")
+    return importi, ambigui
+
+
+def _converti_date(serie):
+    date = pd.to_datetime(serie, format="%d/%m/%Y", errors="coerce")
+    return date.fillna(pd.to_datetime(serie, format="ISO8601", errors="coerce"))
+
+
+def valida_blocco(blocco, tabella, contesto):
+    """Valida e normalizza un blocco con controlli vettoriali.
+
+    Restituisce (lista di (riga nel file, record pronto per il database), DataFrame delle
+    righe scartate).
+    """
+    schema = SCHEMI[tabella]
+    df = blocco.reindex(columns=schema["colonne"]).fillna("")
+    df = df.apply(lambda colonna: colonna.astype(str).str.strip())
+    errori = pd.Series("", index=df.index)
+
+    def segnala(maschera, messaggio):
+        nonlocal errori
+        errori = errori.where(~maschera, errori + messaggio + "; ")
+
+    for colonna in schema["obbligatori"]:
+        segnala(df[colonna] == "", f"{colonna} obbligatorio")
+
+    # Valori predefiniti per le colonne facoltative lasciate vuote
+    oggi = datetime.now().strftime("%d/%m/%Y")
+    for colonna, valore in schema["predefiniti"].items():
+        df[colonna] = df[colonna].mask(df[colonna] == "", oggi if valore is None else valore)
+
+    for colonna in schema["date"]:
+        date = _converti_date(df[colonna])
+        segnala(date.isna() & (df[colonna] != ""), f"{colonna} non è una data valida")
+        df[colonna] = date.dt.strftime("%d/%m/%Y").fillna("")
+
+    for colonna in schema["importi"]:
+        importi, ambigui = _converti_importi(df[colonna])
+        segnala(ambigui, f"{colonna} ambiguo: usa la virgola per i decimali (es. 1.234,56)")
+        segnala(importi.isna() & ~ambigui, f"{colonna} non è un importo valido")
+        segnala(importi < 0, f"{colonna} non può essere negativo")
+        df[colonna] = importi
+
+    for colonna, (tabella_rif, liberi) in schema["riferimenti"].items():
+        ammessi = getattr(contesto, tabella_rif)
+        segnala(~df[colonna].isin(ammessi) & ~df[colonna].isin(liberi),
+                f"{colonna} non trovato in {tabella_rif}")
+
+    if tabella == "preventivi":
+        df["stato"] = df["stato"].str.upper()
+        segnala(~df["stato"].isin(STATI_PREVENTIVO), "stato non valido")
+    elif tabella == "spese":
+        segnala(df["importo"] <= 0, "importo deve essere maggiore di zero")
+        df["detraibile"] = df["detraibile"].str.lower().isin(VALORI_VERI)
+    elif tabella == "eventi_calendario":
+        for colonna in ("ora_inizio", "ora_fine"):
+            ore = pd.to_datetime(df[colonna], format="%H:%M", errors="coerce")
+            segnala(ore.isna(), f"{colonna} deve essere nel formato HH:MM")
+
+    if schema["chiave"]:
+        # Se una chiave compare più volte nel blocco vale l'ultima occorrenza, le precedenti vengono segnalate
+        finora_validi = errori == ""
+        ripetuti = finora_validi & df[schema["chiave"]].where(finora_validi).duplicated(keep="last")
+        segnala(ripetuti, f"{schema['chiave']} ripetuto più avanti nel file: vale l'ultima occorrenza")
+
+    validi = errori == ""
+    scartate = blocco.loc[~validi].copy()
+    scartate.insert(0, "errore", errori[~validi].str.rstrip("; "))
+    # +2: l'intestazione occupa la prima riga del file
+    scartate.insert(0, "riga", scartate.index + 2)
+
+    df_validi = df.loc[validi]
+    return list(zip((df_validi.index + 2).tolist(), df_validi.to_dict("records"))), scartate
+
+
+def _aggiungi_riga(aggiungi, record):
+    try:
+        return bool(aggiungi(record))
+    except Exception:
+        return False
+
+
+def inserisci_batch(db, tabella, records):
+    """Scrive un batch di record e restituisce, per ciascuno, se il database lo ha accettato.
+
+    Se il backend offre upsert_batch il batch viaggia in una sola richiesta (aggiornando
+    i record con la stessa chiave), altrimenti si ripiega sui metodi add_* riga per riga.
+    """
+    schema = SCHEMI[tabella]
+    upsert = getattr(db, "upsert_batch", None)
+    if upsert is not None:
+        return [bool(upsert(tabella, records, on_conflict=schema["chiave"]))] * len(records)
+    aggiungi = getattr(db, schema["metodo"])
+    return [_aggiungi_riga(aggiungi, record) for record in records]
+
+
+def _righe_scartate(validi, errore):
+    return pd.DataFrame([{"riga": riga, "errore": errore, **record} for riga, record in validi])
+
+
+def importa_file(db, tabella, file, nome_file, dimensione_blocco=DIMENSIONE_BLOCCO,
+                 dimensione_batch=DIMENSIONE_BATCH, progresso=None, al_salvataggio=None, riga_iniziale=2):
+    """Importa un file nella tabella indicata, a partire da riga_iniziale (la riga 1 è l'intestazione).
+
+    progresso(esito) viene chiamato dopo ogni blocco e ogni batch salvato, al_salvataggio(tabella, records)
+    dopo ogni batch salvato.
+
+    Spese, scadenze ed eventi non hanno una chiave: reimportare righe già salvate le duplica.
+    Se l'importazione si interrompe va ripresa da esito.riga_ripresa; le righe scartate vanno
+    reimportate dal report errori, non dal file originale.
+    """
+    schema = SCHEMI[tabella]
+    contesto = ContestoImportazione.da_database(db)
+    esito = EsitoImportazione(tabella, riga_ripresa=riga_iniziale)
+
+    # Senza upsert non si possono aggiornare i record esistenti: vengono scartati. Il contesto
+    # include anche quelli salvati dai blocchi precedenti, così una chiave ripetuta non entra due volte
+    esistenti = set()
+    if schema["chiave"] and not hasattr(db, "upsert_batch"):
+        esistenti = getattr(contesto, tabella)
+
+    for blocco, frazione in leggi_a_blocchi(file, nome_file, dimensione_blocco):
+        fine_blocco = int(blocco.index[-1]) + 3 if len(blocco) else esito.riga_ripresa
+        blocco = blocco.loc[blocco.index + 2 >= riga_iniziale]
+        validi, scartate = valida_blocco(blocco, tabella, contesto)
+        if len(scartate):
+            esito.blocchi_errori.append(scartate)
+
+        if esistenti:
+            duplicati = [v for v in validi if v[1][schema["chiave"]] in esistenti]
+            if duplicati:
+                esito.blocchi_errori.append(
+                    _righe_scartate(duplicati, f"{schema['chiave']} già presente nel database"))
+                validi = [v for v in validi if v[1][schema["chiave"]] not in esistenti]
+
+        for inizio in range(0, len(validi), dimensione_batch):
+            batch = validi[inizio:inizio + dimensione_batch]
+            accettati = inserisci_batch(db, tabella, [record for _, record in batch])
+            salvati = [record for (_, record), ok in zip(batch, accettati) if ok]
+            rifiutati = [v for v, ok in zip(batch, accettati) if not ok]
+            if salvati:
+                esito.righe_importate += len(salvati)
+                contesto.registra(tabella, salvati)
+                if al_salvataggio:
+                    al_salvataggio(tabella, salvati)
+            if rifiutati:
+                esito.blocchi_errori.append(
+                    _righe_scartate(rifiutati, "errore del database durante il salvataggio"))
+            esito.riga_ripresa = max(esito.riga_ripresa, batch[-1][0] + 1)
+            if progresso:
+                progresso(esito)
+
+        esito.righe_lette += len(blocco)
+        esito.riga_ripresa = max(esito.riga_ripresa, fine_blocco)
+        esito.avanzamento = frazione
+        if progresso:
+            progresso(esito)
+
+    esito.avanzamento = 1.0
+    return esito
@@ -0,0 +1,393 @@
+"""Test di carico: simula più sessioni Streamlit contemporanee su un backend finto.
+
+Ogni sessione naviga il menu laterale e compila i form (clienti, preventivi, spese,
+scadenze, eventi) contro un backend in memoria con latenza configurabile. Alla fine
+vengono riportati latenza dei rerun (p50/p95/p99), throughput, chiamate al backend
+per interazione e memoria del processo.
+
+AppTest riesegue sempre l'intero script: i rerun limitati a un singolo frammento
+(@st.fragment), che nel server reale scattano quando si interagisce con un form o
+una lista, non vengono misurati. Le latenze riportate sono quindi un limite superiore
+per quelle interazioni.
+
+Per far girare più sessioni AppTest in parallelo il test sostituisce temporaneamente
+alcune parti interne di Streamlit (vedi sessioni_parallele): è verificato sulle versioni
+in VERSIONI_STREAMLIT_VERIFICATE e si rifiuta di partire se quelle parti mancano.
+
+Esempio:
+    python load_test.py --sessioni 20 --iterazioni 3 --latenza-ms 40
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+PERCORSO_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+# Intervallo [minima, massima) di versioni di Streamlit su cui sessioni_parallele è stato verificato
+VERSIONI_STREAMLIT_VERIFICATE = ((1, 37), (1, 67))
+
+
+class BackendSimulato:
+    """Sostituto in memoria di SupabaseManager con latenza iniettata e conteggio delle chiamate."""
+
+    def __init__(self, latenza_ms=0.0, jitter_ms=0.0):
+        self.latenza_ms = latenza_ms
+        self.jitter_ms = jitter_ms
+        self.chiamate = Counter()
+        self._lock = threading.Lock()
+        self._tabelle = defaultdict(list)
+
+    def _attendi(self, metodo):
+        with self._lock:
+            self.chiamate[metodo] += 1
+        ritardo = self.latenza_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if ritardo > 0:
+            time.sleep(ritardo / 1000)
+
+    def _leggi(self, tabella, metodo):
+        self._attendi(metodo)
+        with self._lock:
+            return [dict(r) for r in self._tabelle[tabella]]
+
+    def _scrivi(self, tabella, metodo, record):
+        self._attendi(metodo)
+        with self._lock:
+            self._tabelle[tabella].append(dict(record))
+        return True
+
+    def totale_chiamate(self):
+        with self._lock:
+            return sum(self.chiamate.values())
+
+    def popola(self, clienti=0, preventivi=0):
+        # Dati iniziali senza latenza, per misurare l'app su tabelle di dimensioni realistiche
+        oggi = datetime.now().strftime("%d/%m/%Y")
+        for i in range(clienti):
+            self._tabelle["clienti"].append({"nome": f"Cliente {i}", "email": "", "telefono": "",
+                                             "note": "", "data_creazione": oggi})
+        stati = ["BOZZA", "INVIATO", "ACCETTATO", "RIFIUTATO"]
+        for i in range(preventivi):
+            self._tabelle["preventivi"].append({"numero": f"PREV-{i}", "cliente": f"Cliente {i % max(clienti, 1)}",
+                                                "note": "", "stato": stati[i % 4], "data_creazione": oggi,
+                                                "totale": float(100 + i % 900)})
+
+    def test_connection(self):
+        self._attendi("test_connection")
+        return True
+
+    def get_clienti(self):
+        return self._leggi("clienti", "get_clienti")
+
+    def get_preventivi(self):
+        return self._leggi("preventivi", "get_preventivi")
+
+    def get_spese(self):
+        return self._leggi("spese", "get_spese")
+
+    def get_scadenze(self):
+        return self._leggi("scadenze", "get_scadenze")
+
+    def get_eventi_calendario(self):
+        return self._leggi("eventi_calendario", "get_eventi_calendario")
+
+    def add_cliente(self, cliente):
+        return self._scrivi("clienti", "add_cliente", cliente)
+
+    def add_preventivo(self, preventivo):
+        return self._scrivi("preventivi", "add_preventivo", preventivo)
+
+    def add_spesa(self, spesa):
+        return self._scrivi("spese", "add_spesa", spesa)
+
+    def add_scadenza(self, scadenza):
+        return self._scrivi("scadenze", "add_scadenza", scadenza)
+
+    def add_evento_calendario(self, evento):
+        return self._scrivi("eventi_calendario", "add_evento_calendario", evento)
+
+
+def installa_backend(backend):
+    # L'app importa SupabaseManager da supabase_backend: lo sostituisco prima del primo run
+    modulo = types.ModuleType("supabase_backend")
+    modulo.SupabaseManager = lambda: backend
+    sys.modules["supabase_backend"] = modulo
+
+
+def _verifica_streamlit():
+    import streamlit
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    mancanti = [nome for oggetto, nome in ((Runtime, "_instance"), (Runtime, "exists"), (Runtime, "instance"),
+                                           (ScriptCache, "get_bytecode")) if not hasattr(oggetto, nome)]
+    if mancanti:
+        raise RuntimeError(f"Streamlit {streamlit.__version__} non espone più {', '.join(mancanti)}: "
+                           "sessioni_parallele va aggiornato")
+    versione = tuple(int(p) for p in streamlit.__version__.split(".")[:2] if p.isdigit())
+    minima, massima = VERSIONI_STREAMLIT_VERIFICATE
+    if not minima <= versione < massima:
+        print(f"Attenzione: Streamlit {streamlit.__version__} non è tra le versioni verificate "
+              f"({'.'.join(map(str, minima))} - {'.'.join(map(str, massima))} escluso)", file=sys.stderr)
+
+
+@contextlib.contextmanager
+def sessioni_parallele():
+    """Rende AppTest utilizzabile da più thread contemporaneamente, finché il blocco è attivo.
+
+    A ogni run AppTest crea un Runtime finto e attiva l'opzione global.appTest, poi
+    alla fine azzera entrambi. Con più sessioni in parallelo, la sessione che termina
+    toglierebbe il runtime a quelle ancora in esecuzione (i widget dei form perdono il
+    form_id e risultano duplicati). Come nel server reale, il runtime resta disponibile
+    per tutta la durata del test.
+
+    Inoltre AppTest ricompila lo script a ogni run, mentre il server reale conserva il
+    bytecode tra le sessioni: compilare in parallelo da più thread fallisce in modo
+    intermittente su alcune versioni di Python, quindi il bytecode viene condiviso.
+
+    All'uscita tutte le sostituzioni vengono annullate.
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    _verifica_streamlit()
+    originali = {
+        (Runtime, "exists"): Runtime.__dict__["exists"],
+        (Runtime, "instance"): Runtime.__dict__["instance"],
+        (ScriptCache, "get_bytecode"): ScriptCache.__dict__["get_bytecode"],
+    }
+    app_test = config.get_option("global.appTest")
+
+    config.set_option("global.appTest", True)
+
+    compilati = {}
+    lock_compilazione = threading.Lock()
+    get_bytecode = ScriptCache.get_bytecode
+
+    def bytecode_condiviso(self, percorso):
+        with lock_compilazione:
+            if percorso not in compilati:
+                compilati[percorso] = get_bytecode(self, percorso)
+            return compilati[percorso]
+
+    ScriptCache.get_bytecode = bytecode_condiviso
+
+    ultimo = []
+
+    def attuale(cls):
+        if cls._instance is not None:
+            ultimo[:] = [cls._instance]
+        return ultimo[0] if ultimo else None
+
+    def instance(cls):
+        runtime = attuale(cls)
+        if runtime is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return runtime
+
+    Runtime.exists = classmethod(lambda cls: attuale(cls) is not None)
+    Runtime.instance = classmethod(instance)
+    try:
+        yield
+    finally:
+        for (classe, nome), valore in originali.items():
+            setattr(classe, nome, valore)
+        Runtime._instance = None
+        config.set_option("global.appTest", app_test)
+
+
+def _widget(elementi, etichetta):
+    for elemento in elementi:
+        if elemento.label == etichetta:
+            return elemento
+    raise LookupError(f"Widget '{etichetta}' non trovato")
+
+
+def _menu(voce):
+    return lambda at: at.sidebar.selectbox[0].select(voce)
+
+
+def _invia_cliente(at, codice):
+    _widget(at.text_input, "Nome/Ragione Sociale *").input(f"Cliente LT {codice}")
+    _widget(at.text_input, "Email").input(f"lt{codice}@example.com")
+    _widget(at.button, "Aggiungi Cliente").click()
+
+
+def _invia_preventivo(at, codice):
+    _widget(at.text_input, "Numero Preventivo *").input(f"LT-{codice}")
+    _widget(at.number_input, "Valore Totale €").set_value(float(random.randint(100, 5000)))
+    _widget(at.button, "Crea Preventivo").click()
+
+
+def _invia_spesa(at, codice):
+    _widget(at.number_input, "Importo €").set_value(float(random.randint(5, 500)))
+    _widget(at.text_area, "Descrizione Spesa").input(f"Spesa test di carico {codice}")
+    _widget(at.button, "Aggiungi Spesa").click()
+
+
+def _invia_scadenza(at, codice):
+    _widget(at.text_input, "Titolo Scadenza *").input(f"Scadenza LT {codice}")
+    _widget(at.button, "Aggiungi Scadenza").click()
+
+
+def _invia_evento(at, codice):
+    _widget(at.text_input, "Titolo Evento *").input(f"Evento LT {codice}")
+    _widget(at.button, "Aggiungi Evento").click()
+
+
+def scenario(codice):
+    """Sequenza di (nome interazione, azione sull'AppTest) eseguita da ogni sessione."""
+    return [
+        ("menu: Gestione Clienti", _menu("Gestione Clienti")),
+        ("form: cliente", lambda at: _invia_cliente(at, codice)),
+        ("menu: Gestione Preventivi", _menu("Gestione Preventivi")),
+        ("form: preventivo", lambda at: _invia_preventivo(at, codice)),
+        ("menu: Amministrazione", _menu("Amministrazione")),
+        ("form: spesa", lambda at: _invia_spesa(at, codice)),
+        ("form: scadenza", lambda at: _invia_scadenza(at, codice)),
+        ("form: evento", lambda at: _invia_evento(at, codice)),
+        ("menu: Reports & Export", _menu("Reports & Export")),
+        ("menu: Dashboard", _menu("Dashboard")),
+    ]
+
+
+def esegui_sessione(numero, iterazioni, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    misure = []
+    errori = []
+    at = AppTest.from_file(PERCORSO_APP, default_timeout=timeout)
+
+    inizio = time.perf_counter()
+    at.run()
+    misure.append(("apertura app", time.perf_counter() - inizio))
+
+    for iterazione in range(iterazioni):
+        for nome, azione in scenario(f"{numero}-{iterazione}"):
+            try:
+                azione(at)
+                inizio = time.perf_counter()
+                at.run()
+                misure.append((nome, time.perf_counter() - inizio))
+                if at.exception:
+                    errori.append((nome, at.exception[0].message))
+            except Exception as e:
+                errori.append((nome, str(e)))
+    return misure, errori
+
+
+def _memoria_mb():
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return picco / (1024 * 1024) if sys.platform == "darwin" else picco / 1024
+
+
+def _percentili(durate):
+    valori = np.array(durate) * 1000
+    return {
+        "n": len(valori),
+        "p50_ms": float(np.percentile(valori, 50)),
+        "p95_ms": float(np.percentile(valori, 95)),
+        "p99_ms": float(np.percentile(valori, 99)),
+        "max_ms": float(valori.max()),
+    }
+
+
+def esegui_test(sessioni, iterazioni, latenza_ms, jitter_ms, clienti_iniziali=0,
+                preventivi_iniziali=0, timeout=60):
+    backend = BackendSimulato(latenza_ms, jitter_ms)
+    backend.popola(clienti_iniziali, preventivi_iniziali)
+    installa_backend(backend)
+    # Giornale delle scritture in una cartella temporanea, per non toccare quello dell'app reale
+    os.environ["TALENTO_CODA_SCRITTURE"] = os.path.join(tempfile.mkdtemp(prefix="talento_lt_"), "coda.sqlite3")
+
+    with sessioni_parallele():
+        inizio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessioni) as pool:
+            risultati = list(pool.map(lambda n: esegui_sessione(n, iterazioni, timeout), range(sessioni)))
+        durata = time.perf_counter() - inizio
+
+    misure = [m for sessione, _ in risultati for m in sessione]
+    errori = [e for _, sessione in risultati for e in sessione]
+    per_interazione = defaultdict(list)
+    for nome, secondi in misure:
+        per_interazione[nome].append(secondi)
+
+    return {
+        "sessioni": sessioni,
+        "iterazioni": iterazioni,
+        "latenza_ms": latenza_ms,
+        "durata_s": durata,
+        "interazioni": len(misure),
+        "throughput_rerun_s": len(misure) / durata if durata else 0.0,
+        "latenza": _percentili([s for _, s in misure]),
+        "latenza_per_interazione": {nome: _percentili(d) for nome, d in per_interazione.items()},
+        "chiamate_backend": dict(backend.chiamate),
+        "chiamate_per_interazione": backend.totale_chiamate() / len(misure) if misure else 0.0,
+        "memoria_picco_mb": _memoria_mb(),
+        "errori": errori,
+    }
+
+
+def stampa_report(report):
+    print(f"\nSessioni: {report['sessioni']}  Iterazioni: {report['iterazioni']}  "
+          f"Latenza backend: {report['latenza_ms']:.0f} ms")
+    print(f"Durata: {report['durata_s']:.1f} s  Interazioni: {report['interazioni']}  "
+          f"Throughput: {report['throughput_rerun_s']:.1f} rerun/s")
+    print(f"Chiamate backend per interazione: {report['chiamate_per_interazione']:.2f}  "
+          f"Memoria di picco: {report['memoria_picco_mb']:.0f} MB")
+    print("Rerun completi dello script: i rerun dei soli frammenti (@st.fragment) non sono misurati\n")
+
+    print(f"{'Interazione':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    righe = list(report["latenza_per_interazione"].items()) + [("TOTALE", report["latenza"])]
+    for nome, p in righe:
+        print(f"{nome:<28}{p['n']:>6}{p['p50_ms']:>10.1f}{p['p95_ms']:>10.1f}{p['p99_ms']:>10.1f}{p['max_ms']:>10.1f}")
+
+    print("\nChiamate al backend:")
+    for metodo, n in sorted(report["chiamate_backend"].items()):
+        print(f"  {metodo:<26}{n:>8}")
+
+    if report["errori"]:
+        print(f"\n⚠️  {len(report['errori'])} errori, primi 5:")
+        for nome, messaggio in report["errori"][:5]:
+            print(f"  {nome}: {messaggio}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test di carico di TALENTO AI Suite")
+    parser.add_argument("--sessioni", type=int, default=10, help="sessioni contemporanee")
+    parser.add_argument("--iterazioni", type=int, default=2, help="ripetizioni dello scenario per sessione")
+    parser.add_argument("--latenza-ms", type=float, default=30.0, help="latenza di ogni chiamata al backend")
+    parser.add_argument("--jitter-ms", type=float, default=10.0, help="variazione casuale della latenza")
+    parser.add_argument("--clienti-iniziali", type=int, default=100)
+    parser.add_argument("--preventivi-iniziali", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=60.0, help="timeout di un singolo rerun in secondi")
+    parser.add_argument("--json", help="salva il report completo in questo file")
+    args = parser.parse_args()
+
+    report = esegui_test(args.sessioni, args.iterazioni, args.latenza_ms, args.jitter_ms,
+                         args.clienti_iniziali, args.preventivi_iniziali, args.timeout)
+    stampa_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    # Codice di uscita non nullo se qualche interazione è fallita, utile in CI
+    sys.exit(1 if report["errori"] else 0)
+
+
+if __name__ == "__main__":
+    main()
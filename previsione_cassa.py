@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+# Le settimane partono da oggi, non dal lunedì del calendario
+FREQUENZE = {"Giornaliera": "D", "Settimanale": "7D"}
+# Le scadenze di questi tipi sono già conteggiate altrove (il preventivo è nella pipeline)
+TIPI_SCADENZA_ESCLUSI = {"Preventivo"}
+
+
+def _ordinali(date_testo):
+    # Date "gg/mm/aaaa" convertite in ordinali; le date non valide diventano -1 e vanno scartate
+    giorni = pd.to_datetime(pd.Series(date_testo, dtype=object), format="%d/%m/%Y", errors="coerce")
+    ordinali = (giorni - pd.Timestamp(1970, 1, 1)).dt.days + date(1970, 1, 1).toordinal()
+    return ordinali.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def _importi(valori):
+    return pd.to_numeric(pd.Series(valori, dtype=object), errors="coerce").fillna(0.0).to_numpy(dtype=float)
+
+
+def _colonna(df, nome):
+    return df[nome] if nome in df.columns else pd.Series([None] * len(df), dtype=object)
+
+
+class PrevisioneCassa:
+    """Previsione dei flussi di cassa futuri da scadenze, preventivi aperti e spese.
+
+    Le tabelle vengono convertite in array (giorno, importo) una sola volta e riusate
+    finché alla previsione arriva la stessa lista di record; la proiezione su un orizzonte
+    è un np.bincount per flusso seguito da una somma cumulativa.
+    """
+
+    def __init__(self, risultati_in_memoria=16):
+        self._preparati = {}
+        self._versioni = {}
+        self._risultati = OrderedDict()
+        self._risultati_in_memoria = risultati_in_memoria
+
+    def _prepara(self, tabella, records):
+        # Riconverto solo se la lista è cambiata: leggi() restituisce lo stesso oggetto finché la tabella non cambia
+        precedente = self._preparati.get(tabella)
+        if precedente is not None and precedente[0] is records:
+            return precedente[1]
+
+        df = pd.DataFrame(list(records or []))
+        # Record senza una data valida non si possono collocare nel tempo: restano fuori dalla previsione
+        if tabella == "scadenze":
+            giorni = _ordinali(_colonna(df, "data"))
+            attiva = _colonna(df, "stato").fillna("Attiva").eq("Attiva")
+            inclusa = (attiva & ~_colonna(df, "tipo").isin(TIPI_SCADENZA_ESCLUSI)).to_numpy() & (giorni >= 0)
+            # Una scadenza collegata a un cliente è un incasso, le altre sono pagamenti
+            incasso = _colonna(df, "cliente").fillna("").astype(str).ne("").to_numpy(dtype=bool)
+            preparato = {
+                "giorno": giorni[inclusa],
+                "importo": _importi(_colonna(df, "importo"))[inclusa],
+                "incasso": incasso[inclusa],
+            }
+        elif tabella == "preventivi":
+            giorni = _ordinali(_colonna(df, "data_creazione"))
+            stato = _colonna(df, "stato").fillna("")
+            aperto = stato.isin(["BOZZA", "INVIATO"]).to_numpy() & (giorni >= 0)
+            preparato = {
+                "giorno": giorni[aperto],
+                "importo": _importi(_colonna(df, "totale"))[aperto],
+                "accettati": int(stato.eq("ACCETTATO").sum()),
+                "rifiutati": int(stato.eq("RIFIUTATO").sum()),
+            }
+        else:
+            giorni = _ordinali(_colonna(df, "data"))
+            valida = giorni >= 0
+            preparato = {
+                "giorno": giorni[valida],
+                "importo": _importi(_colonna(df, "importo"))[valida],
+            }
+
+        self._preparati[tabella] = (records, preparato)
+        self._versioni[tabella] = self._versioni.get(tabella, 0) + 1
+        return preparato
+
+    def tasso_accettazione(self, preventivi, predefinito=0.5):
+        """Quota dei preventivi decisi che è stata accettata; il predefinito vale finché non ce ne sono."""
+        p = self._prepara("preventivi", preventivi)
+        decisi = p["accettati"] + p["rifiutati"]
+        return p["accettati"] / decisi if decisi else predefinito
+
+    def prevedi(self, scadenze, preventivi, spese, oggi=None, orizzonte=90, frequenza="D",
+                giorni_incasso=30, finestra_storica=90, saldo_iniziale=0.0):
+        """Entrate, uscite e saldo cumulato previsti da oggi per `orizzonte` giorni.
+
+        - scadenze attive: alla loro data (quelle già scadute si considerano dovute oggi);
+        - preventivi in BOZZA/INVIATO: totale × tasso di accettazione storico,
+          incassato `giorni_incasso` giorni dopo la creazione;
+        - spese: quelle già datate nel futuro più la media giornaliera degli ultimi
+          `finestra_storica` giorni (0 per escluderla).
+        frequenza è "D" (giornaliera) o "7D" (settimane di sette giorni a partire da oggi).
+        """
+        oggi = oggi or date.today()
+        sc = self._prepara("scadenze", scadenze)
+        pr = self._prepara("preventivi", preventivi)
+        sp = self._prepara("spese", spese)
+
+        # I risultati restano validi finché nessuna delle tre tabelle è stata riconvertita
+        chiave = (self._versioni["scadenze"], self._versioni["preventivi"], self._versioni["spese"],
+                  oggi, orizzonte, frequenza, giorni_incasso, finestra_storica, saldo_iniziale)
+        if chiave in self._risultati:
+            self._risultati.move_to_end(chiave)
+            return self._risultati[chiave].copy()
+
+        inizio = oggi.toordinal()
+
+        def giornaliero(giorni, importi):
+            # Gli arretrati confluiscono nel primo giorno, ciò che cade oltre l'orizzonte viene scartato
+            offset = np.maximum(giorni - inizio, 0)
+            dentro = offset < orizzonte
+            return np.bincount(offset[dentro], weights=importi[dentro], minlength=orizzonte)
+
+        tasso = self.tasso_accettazione(preventivi)
+        futuri = sp["giorno"] >= inizio
+        storiche = (sp["giorno"] >= inizio - finestra_storica) & ~futuri
+        media_spese = sp["importo"][storiche].sum() / finestra_storica if finestra_storica else 0.0
+
+        flussi = pd.DataFrame({
+            "incassi_scadenze": giornaliero(sc["giorno"][sc["incasso"]], sc["importo"][sc["incasso"]]),
+            "pipeline_pesata": giornaliero(pr["giorno"] + giorni_incasso, pr["importo"] * tasso),
+            "pagamenti_scadenze": giornaliero(sc["giorno"][~sc["incasso"]], sc["importo"][~sc["incasso"]]),
+            "spese": giornaliero(sp["giorno"][futuri], sp["importo"][futuri]) + media_spese,
+        }, index=pd.date_range(oggi, oggi + timedelta(days=orizzonte - 1), freq="D"))
+
+        # Periodi di `passo` giorni contati da oggi, etichettati con il loro primo giorno
+        passo = to_offset(frequenza).n
+        if passo > 1:
+            flussi = flussi.groupby(flussi.index[np.arange(orizzonte) // passo * passo]).sum()
+        flussi.index.name = "data"
+
+        flussi["entrate"] = flussi["incassi_scadenze"] + flussi["pipeline_pesata"]
+        flussi["uscite"] = flussi["pagamenti_scadenze"] + flussi["spese"]
+        flussi["netto"] = flussi["entrate"] - flussi["uscite"]
+        flussi["saldo"] = saldo_iniziale + flussi["netto"].cumsum()
+
+        self._risultati[chiave] = flussi
+        if len(self._risultati) > self._risultati_in_memoria:
+            self._risultati.popitem(last=False)
+        return flussi.copy()
@@ -0,0 +1,214 @@
+import contextlib
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+# Misura finanziaria in cui confluisce ogni preventivo in base al suo stato
+MISURA_PER_STATO = {
+    "ACCETTATO": "entrate",
+    "BOZZA": "pipeline",
+    "INVIATO": "pipeline",
+    "RIFIUTATO": "rifiutati",
+}
+MISURE = ["entrate", "pipeline", "uscite", "rifiutati"]
+DIMENSIONI = ["stato", "categoria", "cliente"]
+PERIODI = {"Mese": "M", "Trimestre": "Q", "Anno": "Y"}
+
+
+def _righe(date_testo, misura, stato, categoria, cliente, importo):
+    # Le date sono convertite in ordinali (giorni dal calendario gregoriano) per le ricerche binarie
+    giorni = pd.to_datetime(date_testo, format="%d/%m/%Y", errors="coerce")
+    righe = pd.DataFrame({
+        "giorno": (giorni - pd.Timestamp(1970, 1, 1)).dt.days + date(1970, 1, 1).toordinal(),
+        "misura": misura,
+        "stato": stato,
+        "categoria": categoria,
+        "cliente": cliente,
+        "importo": pd.to_numeric(importo, errors="coerce").fillna(0.0),
+    }).dropna(subset=["giorno", "misura"])
+    return righe.astype({"giorno": "int64"})
+
+
+class RollupFinanziario:
+    """Totali pre-aggregati per giorno × misura × stato × categoria × cliente.
+
+    Per ogni combinazione (misura, dimensione, valore) mantiene i totali giornalieri
+    e, su richiesta, le relative somme cumulative: il totale di un intervallo qualsiasi
+    si ottiene con due ricerche binarie, indipendentemente dal numero di record.
+    """
+
+    def __init__(self):
+        # Rientrante: ricostruisci tiene il lock mentre richiama aggiungi
+        self._lock = threading.RLock()
+        self._lock_ricarica = threading.Lock()
+        self._costruito = 0.0
+        self._azzera()
+
+    def _azzera(self):
+        self._giornaliero = defaultdict(lambda: defaultdict(float))
+        self._cumulati = {}
+        self._valori = defaultdict(set)
+        self._cliente_preventivo = {}
+        # Ultimo contributo di ogni preventivo, da togliere quando lo stesso numero viene riscritto
+        self._contributi = {}
+        self._primo_giorno = None
+        self._ultimo_giorno = None
+
+    @classmethod
+    def da_dati(cls, preventivi, spese):
+        rollup = cls()
+        rollup.ricostruisci(preventivi, spese)
+        return rollup
+
+    def ricostruisci(self, preventivi, spese):
+        # Un aggiungi concorrente non può finire tra l'azzeramento e il ricaricamento
+        with self._lock:
+            self._azzera()
+            self.aggiungi("preventivi", preventivi or [])
+            self.aggiungi("spese", spese or [])
+            self._costruito = time.time()
+
+    def eta(self):
+        """Secondi trascorsi dall'ultima ricostruzione completa."""
+        return time.time() - self._costruito
+
+    def ricarica(self, db, scadenza=None, coda=None):
+        """Ricostruisce i totali dai dati confermati del database.
+
+        Con `scadenza` lo fa solo se l'ultima ricostruzione è più vecchia di tanti secondi:
+        così entrano anche le modifiche fatte fuori da questo processo (altre istanze,
+        stato cambiato direttamente sul database). Restituisce True se ha ricostruito.
+
+        Se le scritture arrivano al database tramite una CodaScritture che aggiorna questo
+        rollup alla conferma, va passata come `coda`: l'invio resta sospeso tra la lettura e
+        la ricostruzione, così nessuna scrittura viene contata due volte o persa.
+        """
+        with self._lock_ricarica:
+            # Un'altra sessione potrebbe aver appena ricostruito mentre questa aspettava
+            if scadenza is not None and self.eta() <= scadenza:
+                return False
+            with coda.in_pausa() if coda is not None else contextlib.nullcontext():
+                self.ricostruisci(db.get_preventivi(), db.get_spese())
+            return True
+
+    def aggiungi(self, tabella, records):
+        """Aggiorna i totali con i record appena inseriti o aggiornati (le altre tabelle vengono ignorate).
+
+        Un preventivo con un numero già visto sostituisce il contributo precedente.
+        """
+        if tabella == "preventivi":
+            righe, numeri = self._righe_preventivi(records)
+            with self._lock:
+                righe = self._sostituisci_contributi(righe, numeri)
+                if not righe.empty:
+                    self._accumula(righe)
+        elif tabella == "spese":
+            righe = self._righe_spese(records)
+            if not righe.empty:
+                with self._lock:
+                    self._accumula(righe)
+
+    def _righe_preventivi(self, records):
+        df = pd.DataFrame(list(records)).reindex(columns=["numero", "cliente", "stato", "data_creazione", "totale"])
+        # Nello stesso batch vale l'ultima versione di ogni numero
+        df = df[df["numero"].isna() | ~df["numero"].duplicated(keep="last")]
+        df["cliente"] = df["cliente"].fillna("")
+        self._cliente_preventivo.update(zip(df["numero"].tolist(), df["cliente"].tolist()))
+        righe = _righe(df["data_creazione"], df["stato"].map(MISURA_PER_STATO), df["stato"], "",
+                       df["cliente"], df["totale"])
+        righe["numero"] = df.loc[righe.index, "numero"]
+        return righe, df["numero"].dropna().tolist()
+
+    def _sostituisci_contributi(self, righe, numeri):
+        # Tolgo il contributo precedente dei numeri riscritti (anche se la nuova versione non ha una data valida)
+        precedenti = [self._contributi.pop(n) for n in numeri if n in self._contributi]
+        nuove = righe.dropna(subset=["numero"])
+        righe = righe.drop(columns="numero")
+        colonne = [nuove[c].tolist() for c in righe.columns]
+        self._contributi.update(zip(nuove["numero"].tolist(), zip(*colonne)))
+        if not precedenti:
+            return righe
+        storno = pd.DataFrame(precedenti, columns=righe.columns)
+        storno["importo"] = -storno["importo"]
+        return pd.concat([righe, storno], ignore_index=True)
+
+    def _righe_spese(self, records):
+        df = pd.DataFrame(list(records)).reindex(columns=["data", "categoria", "importo", "progetto"])
+        cliente = df["progetto"].map(self._cliente_preventivo).fillna("")
+        return _righe(df["data"], "uscite", "", df["categoria"].fillna(""), cliente, df["importo"])
+
+    def _accumula(self, righe):
+        # Aggrego il batch per ogni dimensione e sommo i totali giornalieri una volta per combinazione
+        for dimensione in [None] + DIMENSIONI:
+            colonne = ["misura", "giorno"] + ([dimensione] if dimensione else [])
+            totali = righe.groupby(colonne)["importo"].sum()
+            for gruppo, importo in zip(totali.index.tolist(), totali.tolist()):
+                misura, giorno, *valore = gruppo
+                chiave = (misura, dimensione, valore[0] if valore else None)
+                self._giornaliero[chiave][giorno] += importo
+                self._cumulati.pop(chiave, None)
+                if dimensione:
+                    self._valori[(misura, dimensione)].add(chiave[2])
+
+        primo, ultimo = int(righe["giorno"].min()), int(righe["giorno"].max())
+        self._primo_giorno = primo if self._primo_giorno is None else min(self._primo_giorno, primo)
+        self._ultimo_giorno = ultimo if self._ultimo_giorno is None else max(self._ultimo_giorno, ultimo)
+
+    def _indice(self, chiave):
+        # Somme cumulative ricostruite solo quando la serie è cambiata dall'ultima lettura
+        with self._lock:
+            indice = self._cumulati.get(chiave)
+            if indice is None:
+                serie = self._giornaliero.get(chiave, {})
+                giorni = np.array(sorted(serie), dtype=np.int64)
+                importi = np.array([serie[g] for g in giorni], dtype=float)
+                indice = (giorni, np.concatenate(([0.0], np.cumsum(importi))))
+                self._cumulati[chiave] = indice
+            return indice
+
+    def _totali(self, misura, inizi, fini, dimensione=None, valore=None):
+        giorni, cumulati = self._indice((misura, dimensione, valore))
+        da = np.searchsorted(giorni, inizi, side="left")
+        a = np.searchsorted(giorni, fini, side="right")
+        return cumulati[a] - cumulati[da]
+
+    def vuoto(self):
+        return self._primo_giorno is None
+
+    def intervallo(self):
+        """Prima e ultima data presenti nei dati."""
+        if self.vuoto():
+            return None, None
+        return date.fromordinal(self._primo_giorno), date.fromordinal(self._ultimo_giorno)
+
+    def valori(self, dimensione, misura=None):
+        misure = [misura] if misura else MISURE
+        return sorted(set().union(*(self._valori.get((m, dimensione), set()) for m in misure)) - {""})
+
+    def totale(self, misura, inizio, fine, dimensione=None, valore=None):
+        """Totale di una misura tra due date incluse, eventualmente filtrato su una dimensione."""
+        return float(self._totali(misura, [inizio.toordinal()], [fine.toordinal()], dimensione, valore)[0])
+
+    def totali(self, inizio, fine, dimensione=None, valore=None):
+        return {m: self.totale(m, inizio, fine, dimensione, valore) for m in MISURE}
+
+    def ripartizione(self, misura, dimensione, inizio, fine):
+        """Totale della misura per ciascun valore della dimensione nell'intervallo."""
+        return pd.Series({v: self.totale(misura, inizio, fine, dimensione, v)
+                          for v in self.valori(dimensione, misura)}, dtype=float)
+
+    def serie(self, inizio, fine, periodo="M", dimensione=None, valore=None):
+        """Totali per periodo (M, Q, Y) tra due date; i periodi ai bordi sono tagliati sull'intervallo."""
+        periodi = pd.period_range(inizio, fine, freq=periodo)
+        inizi = np.maximum([p.start_time.date().toordinal() for p in periodi], inizio.toordinal())
+        fini = np.minimum([p.end_time.date().toordinal() for p in periodi], fine.toordinal())
+
+        df = pd.DataFrame({m: self._totali(m, inizi, fini, dimensione, valore) for m in MISURE},
+                          index=periodi.astype(str))
+        df.index.name = "periodo"
+        df["utile"] = df["entrate"] - df["uscite"]
+        return df
@@ -0,0 +1,177 @@
+import sqlite3
+
+import pytest
+
+from coda_scritture import CodaScritture
+
+
+class BackendFinto:
+    """Registra l'ordine delle scritture; le tabelle in `guaste` falliscono finché non vengono riparate."""
+
+    def __init__(self):
+        self.scritture = []
+        self.guaste = set()
+
+    def _scrivi(self, tabella, record):
+        if tabella in self.guaste:
+            raise ConnectionError(f"{tabella} non raggiungibile")
+        self.scritture.append((tabella, record))
+        return True
+
+    def add_cliente(self, record):
+        return self._scrivi("clienti", record)
+
+    def add_preventivo(self, record):
+        return self._scrivi("preventivi", record)
+
+    def add_evento_calendario(self, record):
+        return self._scrivi("eventi_calendario", record)
+
+
+@pytest.fixture
+def percorso(tmp_path):
+    return str(tmp_path / "coda.sqlite3")
+
+
+def _anticipa_tentativi(percorso):
+    with sqlite3.connect(percorso) as conn:
+        conn.execute("UPDATE scritture SET prossimo_tentativo = 0")
+
+
+def test_preventivo_non_supera_il_cliente_in_attesa_di_nuovo_tentativo(percorso):
+    db = BackendFinto()
+    coda = CodaScritture(db, percorso)
+    db.guaste.add("clienti")
+    coda.accoda("clienti", {"nome": "Acme"})
+    assert coda.svuota() == 0
+
+    # Arrivate dopo il fallimento: preventivi ed eventi fanno riferimento ai clienti e restano dietro ad Acme
+    coda.accoda("preventivi", {"numero": "P2", "cliente": "Acme"})
+    coda.accoda("eventi_calendario", {"titolo": "Sopralluogo", "cliente": ""})
+    assert coda.svuota() == 0
+    assert db.scritture == []
+
+    db.guaste.clear()
+    _anticipa_tentativi(percorso)
+    while coda.svuota():
+        pass
+    assert [t for t, _ in db.scritture] == ["clienti", "preventivi", "eventi_calendario"]
+
+
+def test_tentativi_addebitati_solo_alle_scritture_inviate(percorso):
+    db = BackendFinto()
+    coda = CodaScritture(db, percorso, tentativi_massimi=2)
+    db.guaste.add("preventivi")
+    coda.accoda("preventivi", {"numero": "P1", "cliente": "Acme"})
+    coda.accoda("preventivi", {"numero": "P2", "cliente": "Acme"})
+    coda.accoda("clienti", {"nome": "Beta"})
+
+    coda.svuota()
+    assert db.scritture == [("clienti", {"nome": "Beta"})]
+    with sqlite3.connect(percorso) as conn:
+        tentativi = dict(conn.execute("SELECT json_extract(record, '$.numero'), tentativi FROM scritture "
+                                      "WHERE tabella = 'preventivi'"))
+    assert tentativi == {"P1": 1, "P2": 0}
+
+    _anticipa_tentativi(percorso)
+    coda.svuota()
+    assert coda.conteggi() == {"fallita": 1, "in_attesa": 1}
+    db.guaste.clear()
+    coda.svuota()
+    assert db.scritture[-1] == ("preventivi", {"numero": "P2", "cliente": "Acme"})
+
+
+def test_al_salvataggio_chiamato_solo_dopo_la_conferma(percorso):
+    db = BackendFinto()
+    confermate = []
+    coda = CodaScritture(db, percorso, al_salvataggio=lambda tabella, records: confermate.append((tabella, records)))
+    db.guaste.add("clienti")
+    coda.accoda("clienti", {"nome": "Acme"})
+    coda.svuota()
+    assert confermate == []
+    assert coda.in_attesa("clienti") == [{"nome": "Acme"}]
+
+    db.guaste.clear()
+    _anticipa_tentativi(percorso)
+    coda.svuota()
+    assert confermate == [("clienti", [{"nome": "Acme"}])]
+    assert coda.in_attesa("clienti") == []
+
+
+def test_chiave_ripetuta_accodata_una_volta(percorso):
+    db = BackendFinto()
+    coda = CodaScritture(db, percorso)
+    coda.accoda("clienti", {"nome": "Acme"}, chiave="k1")
+    coda.accoda("clienti", {"nome": "Acme"}, chiave="k1")
+    coda.svuota()
+    assert db.scritture == [("clienti", {"nome": "Acme"})]
+
+
+def test_scritture_a_meta_invio_riprese_al_riavvio(percorso):
+    CodaScritture(BackendFinto(), percorso).accoda("clienti", {"nome": "Acme"})
+    with sqlite3.connect(percorso) as conn:
+        conn.execute("UPDATE scritture SET stato = 'in_invio'")
+
+    db = BackendFinto()
+    CodaScritture(db, percorso).svuota()
+    assert db.scritture == [("clienti", {"nome": "Acme"})]
+
+
+class DatabaseSpese:
+    def __init__(self):
+        self.spese = []
+
+    def get_preventivi(self):
+        return []
+
+    def get_spese(self):
+        return list(self.spese)
+
+    def add_spesa(self, spesa):
+        self.spese.append(spesa)
+        return True
+
+
+def test_ricarica_del_rollup_non_conta_due_volte_le_scritture_in_coda(percorso):
+    from datetime import date
+
+    from rollup import RollupFinanziario
+
+    db = DatabaseSpese()
+    rollup = RollupFinanziario()
+    coda = CodaScritture(db, percorso, al_salvataggio=rollup.aggiungi)
+    coda.accoda("spese", {"data": "15/03/2025", "categoria": "Materiali", "importo": 30, "progetto": "Generale"})
+
+    # "Ricarica Dati" mentre la spesa è ancora in coda, poi l'invio va a buon fine
+    rollup.ricarica(db, coda=coda)
+    coda.svuota()
+
+    assert rollup.totale("uscite", date(2025, 1, 1), date(2025, 12, 31)) == 30
+
+
+def test_in_pausa_blocca_gli_invii(percorso):
+    import threading
+
+    db = BackendFinto()
+    coda = CodaScritture(db, percorso)
+    coda.accoda("clienti", {"nome": "Acme"})
+    with coda.in_pausa():
+        invio = threading.Thread(target=coda.svuota)
+        invio.start()
+        invio.join(0.2)
+        assert invio.is_alive() and db.scritture == []
+    invio.join()
+    assert db.scritture == [("clienti", {"nome": "Acme"})]
+
+
+def test_scritture_fallite_consultabili_e_scartabili(percorso):
+    db = BackendFinto()
+    db.guaste.add("clienti")
+    coda = CodaScritture(db, percorso, tentativi_massimi=1)
+    coda.accoda("clienti", {"nome": "Acme"})
+    coda.svuota()
+
+    assert [(f["tabella"], f["record"], f["errore"]) for f in coda.fallite()] == [
+        ("clienti", {"nome": "Acme"}, "clienti non raggiungibile")]
+    coda.scarta_fallite()
+    assert coda.fallite() == [] and coda.conteggi() == {}
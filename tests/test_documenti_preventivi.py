@@ -0,0 +1,47 @@
+import base64
+import re
+import zipfile
+import zlib
+
+import pytest
+
+pytest.importorskip("reportlab")
+
+import documenti_preventivi  # noqa: E402
+
+
+def _testo_pdf(pdf):
+    # Contenuto delle pagine decompresso (reportlab usa FlateDecode, talvolta dopo ASCII85)
+    testo = b""
+    for flusso in re.findall(rb"stream\r?\n(.*?)endstream", pdf, re.S):
+        flusso = flusso.strip()
+        if flusso.endswith(b"~>"):
+            flusso = base64.a85decode(flusso, adobe=True)
+        try:
+            testo += zlib.decompress(flusso)
+        except zlib.error:
+            testo += flusso
+    return testo
+
+
+def test_intestazione_senza_markup_letterale():
+    pdf = documenti_preventivi.genera_pdf({"numero": "P1", "data_creazione": "01/01/2025", "stato": "BOZZA",
+                                           "totale": 10})
+    testo = _testo_pdf(pdf)
+    # Data e stato su due righe, senza il tag <br/> stampato come testo
+    assert re.search(rb"\(Data: 01/01/2025\) Tj\s+T\*", testo)
+    assert b"(Stato: BOZZA)" in testo
+    assert b"br/" not in testo
+
+
+def test_zip_con_numeri_duplicati_e_progresso():
+    preventivi = [{"numero": n, "data_creazione": "01/01/2025", "stato": "BOZZA", "totale": 10}
+                  for n in ("P1", "P2", "P1")]
+    chiamate = []
+    archivio = documenti_preventivi.genera_zip(preventivi, [], progresso=lambda *a: chiamate.append(a))
+
+    with zipfile.ZipFile(archivio) as zip_file:
+        nomi = zip_file.namelist()
+        assert all(zip_file.read(nome).startswith(b"%PDF") for nome in nomi)
+    assert sorted(nomi) == ["preventivo_P1.pdf", "preventivo_P1_2.pdf", "preventivo_P2.pdf"]
+    assert chiamate == [(1, 3), (2, 3), (3, 3)]
@@ -0,0 +1,158 @@
+import io
+from datetime import time
+
+import pandas as pd
+import pytest
+
+from importazione import _cella_testo, _converti_importi, importa_file, inserisci_batch
+
+
+class BackendFinto:
+    """Backend senza upsert_batch: le scritture passano dai metodi add_*."""
+
+    def __init__(self, clienti=(), rifiuta=()):
+        self.clienti = [{"nome": n} for n in clienti]
+        self.preventivi = []
+        self.eventi = []
+        self.rifiuta = set(rifiuta)
+
+    def get_clienti(self):
+        return self.clienti
+
+    def get_preventivi(self):
+        return self.preventivi
+
+    def add_cliente(self, cliente):
+        if cliente["nome"] in self.rifiuta:
+            return False
+        self.clienti.append(cliente)
+        return True
+
+    def add_evento_calendario(self, evento):
+        self.eventi.append(evento)
+        return True
+
+
+def _csv(*righe):
+    return io.BytesIO(("\n".join(righe) + "\n").encode("utf-8"))
+
+
+def test_chiave_ripetuta_in_blocchi_diversi_inserita_una_volta():
+    db = BackendFinto()
+    esito = importa_file(db, "clienti", _csv("nome", "A", "B", "A"), "clienti.csv", dimensione_blocco=2)
+
+    assert [c["nome"] for c in db.clienti] == ["A", "B"]
+    assert esito.righe_importate == 2
+    report = esito.report_errori()
+    assert report["riga"].tolist() == [4]
+    assert "già presente" in report["errore"].iloc[0]
+
+
+def test_righe_accettate_non_finiscono_nel_report():
+    db = BackendFinto(rifiuta={"C"})
+    esito = importa_file(db, "clienti", _csv("nome", "C", "D"), "clienti.csv")
+
+    assert [c["nome"] for c in db.clienti] == ["D"]
+    assert esito.righe_importate == 1
+    report = esito.report_errori()
+    assert report["nome"].tolist() == ["C"]
+    assert report["riga"].tolist() == [2]
+
+
+def test_duplicati_nello_stesso_blocco_segnalati():
+    db = BackendFinto()
+    esito = importa_file(db, "clienti", _csv("nome,email", "A,prima@x.it", "A,seconda@x.it"), "clienti.csv")
+
+    assert db.clienti == [{"nome": "A", "email": "seconda@x.it", "telefono": "", "note": "",
+                           "data_creazione": db.clienti[0]["data_creazione"]}]
+    assert esito.righe_lette == esito.righe_importate + esito.righe_scartate
+    assert esito.report_errori()["riga"].tolist() == [2]
+
+
+def test_inserisci_batch_riporta_esito_per_riga():
+    db = BackendFinto(rifiuta={"B"})
+    assert inserisci_batch(db, "clienti", [{"nome": "A"}, {"nome": "B"}, {"nome": "C"}]) == [True, False, True]
+
+
+def test_orari_excel_convertiti_in_hh_mm(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["titolo", "data", "ora_inizio", "ora_fine"])
+    ws.append(["Sopralluogo", "02/01/2025", time(9, 0), time(10, 30)])
+    percorso = tmp_path / "eventi.xlsx"
+    wb.save(percorso)
+
+    db = BackendFinto()
+    with open(percorso, "rb") as file:
+        esito = importa_file(db, "eventi_calendario", file, "eventi.xlsx")
+
+    assert esito.righe_scartate == 0
+    assert (db.eventi[0]["ora_inizio"], db.eventi[0]["ora_fine"]) == ("09:00", "10:30")
+
+
+@pytest.mark.parametrize("testo, atteso", [
+    ("3.000", 3000.0),
+    ("€ 3.000", 3000.0),
+    ("1.234", 1234.0),
+    ("1.234.567", 1234567.0),
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("1234,56", 1234.56),
+    ("12.50", 12.5),
+    ("-5", -5.0),
+])
+def test_importi_italiani_e_inglesi(testo, atteso):
+    importi, ambigui = _converti_importi(pd.Series([testo]))
+    assert importi.iloc[0] == pytest.approx(atteso)
+    assert not ambigui.iloc[0]
+
+
+@pytest.mark.parametrize("testo", ["1,234,567", "1.234.56"])
+def test_importi_ambigui_segnalati(testo):
+    db = BackendFinto(clienti=["Acme"])
+    esito = importa_file(db, "preventivi", _csv("numero,cliente,totale", f'P1,Acme,"{testo}"'), "preventivi.csv")
+
+    assert esito.righe_importate == 0
+    assert "totale ambiguo" in esito.report_errori()["errore"].iloc[0]
+
+
+def test_numeri_excel_non_scambiati_per_migliaia():
+    assert _cella_testo(1.234) == "1,234"
+    assert _cella_testo(3000.0) == "3000"
+    assert _converti_importi(pd.Series([_cella_testo(1.234)]))[0].iloc[0] == pytest.approx(1.234)
+
+
+class BackendInterrotto(BackendFinto):
+    """Backend che smette di rispondere dopo un certo numero di spese salvate."""
+
+    def __init__(self, limite):
+        super().__init__()
+        self.spese = []
+        self.limite = limite
+
+    def add_spesa(self, spesa):
+        if len(self.spese) >= self.limite:
+            raise ConnectionError("backend non raggiungibile")
+        self.spese.append(spesa)
+        return True
+
+    def upsert_batch(self, tabella, records, on_conflict=None):
+        for record in records:
+            self.add_spesa(record)
+        return True
+
+
+def test_ripresa_di_importazione_interrotta_senza_duplicati():
+    righe = ["data,descrizione,importo"] + [f"01/03/2025,Spesa {i},10" for i in range(10)]
+    db = BackendInterrotto(limite=4)
+    esiti = []
+    with pytest.raises(ConnectionError):
+        importa_file(db, "spese", _csv(*righe), "spese.csv", dimensione_batch=2, progresso=esiti.append)
+    assert len(db.spese) == 4
+    assert esiti[-1].riga_ripresa == 6  # righe 2-5 salvate
+
+    db.limite = 100
+    esito = importa_file(db, "spese", _csv(*righe), "spese.csv", riga_iniziale=esiti[-1].riga_ripresa)
+    assert esito.righe_importate == 6
+    assert [s["descrizione"] for s in db.spese] == [f"Spesa {i}" for i in range(10)]
@@ -0,0 +1,64 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from previsione_cassa import PrevisioneCassa
+
+OGGI = date(2026, 10, 21)  # mercoledì
+
+
+def _preventivo(stato, totale, data):
+    return {"numero": f"{stato}-{data}", "cliente": "Acme", "stato": stato, "totale": totale, "data_creazione": data}
+
+
+def test_preventivo_senza_data_valida_escluso():
+    preventivi = [_preventivo("INVIATO", 1000, ""), _preventivo("BOZZA", 500, "non è una data")]
+    flussi = PrevisioneCassa().prevedi([], preventivi, [], oggi=OGGI, orizzonte=30, finestra_storica=0)
+    assert flussi["pipeline_pesata"].sum() == 0
+
+
+def test_pipeline_pesata_dal_tasso_storico():
+    preventivi = [
+        _preventivo("ACCETTATO", 100, "01/09/2026"),
+        _preventivo("ACCETTATO", 100, "02/09/2026"),
+        _preventivo("RIFIUTATO", 100, "03/09/2026"),
+        _preventivo("RIFIUTATO", 100, "04/09/2026"),
+        _preventivo("INVIATO", 1000, "11/10/2026"),
+    ]
+    flussi = PrevisioneCassa().prevedi([], preventivi, [], oggi=OGGI, orizzonte=30, finestra_storica=0)
+    # 1000 × 50%, incassato 30 giorni dopo la creazione
+    assert flussi.loc[pd.Timestamp(2026, 11, 10), "pipeline_pesata"] == 500
+    assert flussi["entrate"].sum() == 500
+
+
+def test_scadenze_per_verso_e_arretrati_a_oggi():
+    scadenze = [
+        {"data": "01/10/2026", "tipo": "Pagamento", "cliente": "Acme", "importo": 300, "stato": "Attiva"},
+        {"data": "25/10/2026", "tipo": "Rinnovo", "cliente": "", "importo": 80, "stato": "Attiva"},
+        {"data": "25/10/2026", "tipo": "Preventivo", "cliente": "Acme", "importo": 999, "stato": "Attiva"},
+        {"data": "32/13/2026", "tipo": "Pagamento", "cliente": "Acme", "importo": 50, "stato": "Attiva"},
+    ]
+    flussi = PrevisioneCassa().prevedi(scadenze, [], [], oggi=OGGI, orizzonte=10, finestra_storica=0,
+                                       saldo_iniziale=1000)
+    assert flussi.loc[pd.Timestamp(OGGI), "incassi_scadenze"] == 300
+    assert flussi.loc[pd.Timestamp(2026, 10, 25), "pagamenti_scadenze"] == 80
+    assert flussi["saldo"].iloc[-1] == 1220
+
+
+def test_settimane_ancorate_a_oggi():
+    spese = [{"data": "22/10/2026", "importo": 10}, {"data": "28/10/2026", "importo": 20}]
+    flussi = PrevisioneCassa().prevedi([], [], spese, oggi=OGGI, orizzonte=7, frequenza="7D", finestra_storica=0)
+    assert list(flussi.index) == [pd.Timestamp(OGGI)]
+    assert flussi["spese"].iloc[0] == 10
+
+
+def test_risultato_riusato_finche_le_tabelle_non_cambiano():
+    previsione = PrevisioneCassa()
+    spese = [{"data": "22/10/2026", "importo": 10}]
+    prima = previsione.prevedi([], [], spese, oggi=OGGI, orizzonte=7, finestra_storica=0)
+    prima.loc[:, "spese"] = 0  # la copia restituita non altera la cache
+    assert previsione.prevedi([], [], spese, oggi=OGGI, orizzonte=7, finestra_storica=0)["spese"].sum() == 10
+
+    spese = spese + [{"data": "23/10/2026", "importo": 5}]
+    assert previsione.prevedi([], [], spese, oggi=OGGI, orizzonte=7, finestra_storica=0)["spese"].sum() == pytest.approx(15)
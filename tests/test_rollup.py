@@ -0,0 +1,72 @@
+from datetime import date
+
+from rollup import RollupFinanziario
+
+INIZIO, FINE = date(2025, 1, 1), date(2025, 12, 31)
+
+
+def _preventivo(numero, stato, totale, data="10/03/2025", cliente="Acme"):
+    return {"numero": numero, "cliente": cliente, "stato": stato, "data_creazione": data, "totale": totale}
+
+
+def test_preventivo_riscritto_sostituisce_il_precedente():
+    rollup = RollupFinanziario.da_dati([_preventivo("P1", "BOZZA", 100)], [])
+    rollup.aggiungi("preventivi", [_preventivo("P1", "ACCETTATO", 100)])
+
+    totali = rollup.totali(INIZIO, FINE)
+    assert totali["pipeline"] == 0
+    assert totali["entrate"] == 100
+    assert rollup.totale("entrate", INIZIO, FINE, "cliente", "Acme") == 100
+
+
+def test_nuova_versione_con_data_diversa_sposta_il_totale():
+    rollup = RollupFinanziario.da_dati([_preventivo("P1", "ACCETTATO", 100)], [])
+    rollup.aggiungi("preventivi", [_preventivo("P1", "ACCETTATO", 250, data="01/06/2025")])
+
+    assert rollup.totale("entrate", date(2025, 3, 1), date(2025, 3, 31)) == 0
+    assert rollup.totale("entrate", date(2025, 6, 1), date(2025, 6, 30)) == 250
+
+
+def test_stesso_numero_ripetuto_nel_batch_conta_una_volta():
+    rollup = RollupFinanziario.da_dati([], [])
+    rollup.aggiungi("preventivi", [_preventivo("P1", "BOZZA", 100), _preventivo("P1", "RIFIUTATO", 80)])
+
+    totali = rollup.totali(INIZIO, FINE)
+    assert (totali["pipeline"], totali["rifiutati"]) == (0, 80)
+
+
+def test_spese_si_sommano_e_seguono_il_cliente_del_progetto():
+    rollup = RollupFinanziario.da_dati([_preventivo("P1", "ACCETTATO", 100)], [])
+    spesa = {"data": "15/03/2025", "categoria": "Materiali", "importo": 30, "progetto": "P1"}
+    rollup.aggiungi("spese", [spesa])
+    rollup.aggiungi("spese", [spesa])
+
+    assert rollup.totale("uscite", INIZIO, FINE, "cliente", "Acme") == 60
+    assert rollup.serie(INIZIO, FINE, "Q").loc["2025Q1", "utile"] == 40
+
+
+class DatabaseFinto:
+    def __init__(self, preventivi=(), spese=()):
+        self.preventivi = list(preventivi)
+        self.spese = list(spese)
+
+    def get_preventivi(self):
+        return [dict(p) for p in self.preventivi]
+
+    def get_spese(self):
+        return [dict(s) for s in self.spese]
+
+
+def test_stato_cambiato_fuori_dal_processo_entra_dopo_la_scadenza():
+    db = DatabaseFinto([_preventivo("P1", "BOZZA", 100)])
+    rollup = RollupFinanziario()
+    assert rollup.ricarica(db, scadenza=60)
+
+    # Il preventivo viene accettato direttamente sul database
+    db.preventivi[0]["stato"] = "ACCETTATO"
+    assert not rollup.ricarica(db, scadenza=60)
+    assert rollup.totali(INIZIO, FINE)["entrate"] == 0
+
+    assert rollup.ricarica(db, scadenza=0)
+    totali = rollup.totali(INIZIO, FINE)
+    assert (totali["entrate"], totali["pipeline"]) == (100, 0)